@@ -56,18 +56,30 @@ from ve_utils import wrap_dbus_value, unwrap_dbus_value
 #   The signature of a variant is 'v'.
 
 # Export ourselves as a D-Bus service.
+#
+# When signaltext is False, the Text of the changed items is left out of the
+# PropertiesChanged and ItemsChanged signals, and only rendered when a client
+# calls GetText.
 class VeDbusService(object):
-	def __init__(self, servicename, bus=None):
+	def __init__(self, servicename, bus=None, signaltext=True):
+		self._signaltext = signaltext
+
 		# dict containing the VeDbusItemExport objects, with their path as the key.
 		self._dbusobjects = {}
 		self._dbusnodes = {}
 
+		# prefix tree of the exported paths, see _get_tree_dict
+		self._index = PathIndexNode()
+
 		# dict containing the onchange callbacks, for each object. Object path is the key
 		self._onchangecallbacks = {}
 
 		# Connect to session bus whenever present, else use the system bus
 		self._dbusconn = bus or (dbus.SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus())
 
+		# stack of ServiceContext, see __enter__
+		self._ratelimiters = []
+
 		# make the dbus connection available to outside, could make this a true property instead, but ach..
 		self.dbusconn = self._dbusconn
 
@@ -75,23 +87,45 @@ class VeDbusService(object):
 		self._dbusname = dbus.service.BusName(servicename, self._dbusconn, do_not_queue=True)
 
 		# Add the root item that will return all items as a tree
-		self._dbusnodes['/'] = self._create_tree_export(self._dbusconn, '/', self._get_tree_dict)
+		self._dbusnodes['/'] = VeDbusRootExport(self._dbusconn, '/', self._get_tree_dict, self._get_items)
 
 		logging.info("registered ourselves on D-Bus as %s" % servicename)
 
+	## Returns the values (or texts) of the items below path, with their path
+	# relative to it as the key. Only the subtree of path is visited, and the
+	# wrapped values are cached until one of the items below changes.
 	def _get_tree_dict(self, path, get_text=False):
 		logging.debug("_get_tree_dict called for %s" % path)
+		node = self._index.find(path)
+		if node is None:
+			return {}
+		if not get_text and node.values is not None:
+			return node.values
 		r = {}
-		px = path
-		if not px.endswith('/'):
-			px += '/'
-		for p, item in self._dbusobjects.items():
-			if p.startswith(px):
-				v = item.GetText() if get_text else wrap_dbus_value(item.local_get_value())
-				r[p[len(px):]] = v
+		for p, item in node.walk(''):
+			r[p] = item.GetText() if get_text else wrap_dbus_value(item.local_get_value())
+		if not get_text:
+			node.values = r
 		logging.debug(r)
 		return r
 
+	## Returns the Value and Text of all the items, with their path as the key
+	def _get_items(self):
+		r = {}
+		for path, item in self._dbusobjects.items():
+			r[path] = {'Value': wrap_dbus_value(item.local_get_value()), 'Text': item.GetText()}
+		return r
+
+	# Called by the VeDbusItemExport objects when their value changed
+	def _item_changed(self, path):
+		node = self._index
+		node.values = None
+		for name in path.split('/')[1:]:
+			node = node.children.get(name)
+			if node is None:
+				return
+			node.values = None
+
 	# To force immediate deregistering of this dbus service and all its object paths, explicitly
 	# call __del__().
 	def __del__(self):
@@ -101,6 +135,7 @@ class VeDbusService(object):
 		for item in self._dbusobjects.values():
 			item.__del__()
 		self._dbusobjects.clear()
+		self._index = PathIndexNode()
 		if self._dbusname:
 			self._dbusname.__del__()  # Forces call to self._bus.release_name(self._name), see source code
 		self._dbusname = None
@@ -116,7 +151,8 @@ class VeDbusService(object):
 
 		item = VeDbusItemExport(
 				self._dbusconn, path, value, description, writeable,
-				self._value_changed, gettextcallback, deletecallback=self._item_deleted)
+				self._value_changed, gettextcallback, deletecallback=self._item_deleted,
+				signaltext=self._signaltext, changedcallback=self._item_changed)
 
 		spl = path.split('/')
 		for i in range(2, len(spl)):
@@ -124,6 +160,7 @@ class VeDbusService(object):
 			if subPath not in self._dbusnodes and subPath not in self._dbusobjects:
 				self._dbusnodes[subPath] = self._create_tree_export(self._dbusconn, subPath, self._get_tree_dict)
 		self._dbusobjects[path] = item
+		self._index.add(path, item)
 		logging.debug('added %s with start value %s. Writeable is %s' % (path, value, writeable))
 
 	# Add the mandatory paths, as per victron dbus api doc
@@ -154,20 +191,61 @@ class VeDbusService(object):
 
 	def _item_deleted(self, path):
 		self._dbusobjects.pop(path)
-		for np in self._dbusnodes.keys():
-			if np != '/':
-				for ip in self._dbusobjects:
-					if ip.startswith(np + '/'):
-						break
-				else:
-					self._dbusnodes[np].__del__()
-					self._dbusnodes.pop(np)
+		names = path.split('/')[1:]
+		nodes = [self._index]
+		for name in names:
+			nodes.append(nodes[-1].children[name])
+		nodes[-1].item = None
+		for node in nodes:
+			node.values = None
+
+		# Remove the branches left without items, and their tree exports
+		for i in range(len(names), 0, -1):
+			if nodes[i].item is not None or nodes[i].children:
+				break
+			del nodes[i - 1].children[names[i - 1]]
+			np = '/'.join([''] + names[:i])
+			if np in self._dbusnodes:
+				self._dbusnodes.pop(np).__del__()
 
 	def __getitem__(self, path):
 		return self._dbusobjects[path].local_get_value()
 
 	def __setitem__(self, path, newvalue):
-		self._dbusobjects[path].local_set_value(newvalue)
+		if self._ratelimiters:
+			self._ratelimiters[-1][path] = newvalue
+		else:
+			self._dbusobjects[path].local_set_value(newvalue)
+
+	## Sets several values at once, see __enter__.
+	# @param values	dict of the new values, with their path as the key.
+	def update_many(self, values):
+		with self as s:
+			for path, value in values.items():
+				s[path] = value
+
+	## Batched updates: the values set in a with block on the service are
+	# published with a single ItemsChanged signal on the root object when the
+	# block ends, instead of one PropertiesChanged signal per path. Unchanged
+	# values are not published at all. The changes of a nested block are
+	# published with those of the outermost one.
+	#
+	#	with self._dbusservice as s:
+	#		s['/Ac/Power'] = 100
+	#		s['/Ac/Voltage'] = 230
+	def __enter__(self):
+		l = ServiceContext(self)
+		self._ratelimiters.append(l)
+		return l
+
+	def __exit__(self, *exc):
+		# pop off the top context and flush it, or hand its changes over to
+		# the enclosing context
+		l = self._ratelimiters.pop()
+		if self._ratelimiters:
+			self._ratelimiters[-1].changes.update(l.changes)
+		else:
+			l.flush()
 
 	def __delitem__(self, path):
 		self._dbusobjects[path].__del__()  # Invalidates and then removes the object path
@@ -176,6 +254,66 @@ class VeDbusService(object):
 	def __contains__(self, path):
 		return path in self._dbusobjects
 
+class ServiceContext(object):
+	def __init__(self, parent):
+		self.parent = parent
+		self.changes = {}
+
+	def __getitem__(self, path):
+		return self.parent[path]
+
+	def __setitem__(self, path, newvalue):
+		c = self.parent._dbusobjects[path]._local_set_value(newvalue)
+		if c is not None:
+			self.changes[path] = c
+
+	def flush(self):
+		if self.changes:
+			self.parent._dbusnodes['/'].ItemsChanged(self.changes)
+			self.changes = {}
+
+## A node of the prefix tree of the paths exported by a VeDbusService. The
+# children are indexed by the name of the next path component, item is the
+# VeDbusItemExport at the path of the node if any, and values caches the
+# wrapped values of the subtree for GetValue on tree nodes.
+class PathIndexNode(object):
+	__slots__ = ('children', 'item', 'values')
+
+	def __init__(self):
+		self.children = {}
+		self.item = None
+		self.values = None
+
+	def add(self, path, item):
+		node = self
+		node.values = None
+		for name in path.split('/')[1:]:
+			child = node.children.get(name)
+			if child is None:
+				child = node.children[name] = PathIndexNode()
+			node = child
+			node.values = None
+		node.item = item
+
+	def find(self, path):
+		node = self
+		for name in path.split('/')[1:]:
+			if name == '':
+				continue
+			node = node.children.get(name)
+			if node is None:
+				return None
+		return node
+
+	## Yields the (relative path, item) of all the items below this node
+	def walk(self, prefix):
+		for name, child in self.children.items():
+			p = prefix + name
+			if child.item is not None:
+				yield p, child.item
+			for i in child.walk(p + '/'):
+				yield i
+
 """
 Importing basics:
 	- If when we power up, the D-Bus service does not exist, or it does exist and the path does not
@@ -315,6 +453,165 @@ class VeDbusItemImport(object):
 					traceback.print_exc()
 					os._exit(1)  # sys.exit() is not used, since that also throws an exception
 
+## Process-wide cache of the values imported from other services.
+#
+# Each VeDbusItemImport adds its own match rule and does a blocking GetValue
+# when created. VeDbusImportManager adds two match rules per service instead
+# (PropertiesChanged on all its objects and ItemsChanged on its root), fetches
+# the initial values asynchronously with a single GetItems call, falling back
+# to GetValue per path for the services that do not export it, and lets any
+# number of consumers watch the same path.
+#
+#	imports = VeDbusImportManager.get(bus)
+#	imports.watch('com.victronenergy.battery.ttyO1', '/Dc/0/Voltage', callback)
+#	imports.get_value('com.victronenergy.battery.ttyO1', '/Dc/0/Voltage')
+#
+# The callbacks are called like the eventCallback of VeDbusItemImport, with the
+# service name, the path and the changes. Values are invalidated when the service
+# leaves the bus, and fetched again when it comes back.
+class VeDbusImportManager(object):
+	_managers = {}
+
+	## Returns the manager of bus, creating it on first use
+	@classmethod
+	def get(cls, bus):
+		manager = cls._managers.get(bus)
+		if manager is None:
+			manager = cls._managers[bus] = cls(bus)
+		return manager
+
+	def __init__(self, bus):
+		self._bus = bus
+		self._services = {}
+		self._match = bus.add_signal_receiver(self._name_owner_changed, signal_name='NameOwnerChanged',
+			dbus_interface='org.freedesktop.DBus')
+
+	## Calls callback when the value of path on serviceName changes, importing
+	# the service if it is not yet.
+	def watch(self, serviceName, path, callback=None):
+		service = self._services.get(serviceName)
+		if service is None:
+			service = self._services[serviceName] = VeDbusImportedService(self._bus, serviceName)
+		service.watch(path, callback)
+
+	def unwatch(self, serviceName, path, callback):
+		service = self._services.get(serviceName)
+		if service is not None:
+			service.unwatch(path, callback)
+
+	## Returns the cached value of path on serviceName, None when it is invalid
+	# or not known (yet).
+	def get_value(self, serviceName, path):
+		service = self._services.get(serviceName)
+		if service is None:
+			return None
+		return service.values.get(path)
+
+	## Stops importing serviceName and removes its match rules
+	def remove_service(self, serviceName):
+		service = self._services.pop(serviceName, None)
+		if service is not None:
+			service.close()
+
+	def _name_owner_changed(self, name, oldOwner, newOwner):
+		service = self._services.get(name)
+		if service is None:
+			return
+		if newOwner:
+			service.fetch()
+		else:
+			service.invalidate()
+
+## The values imported from one service, see VeDbusImportManager
+class VeDbusImportedService(object):
+	def __init__(self, bus, serviceName):
+		self._bus = bus
+		self._serviceName = serviceName
+		self._callbacks = {}
+		# whether the service exports GetItems, None while not known
+		self._getitems = None
+		self.values = {}
+		self._matches = [
+			bus.add_signal_receiver(self._properties_changed_handler, signal_name='PropertiesChanged',
+				dbus_interface='com.victronenergy.BusItem', bus_name=serviceName, path_keyword='path'),
+			bus.add_signal_receiver(self._items_changed_handler, signal_name='ItemsChanged',
+				dbus_interface='com.victronenergy.BusItem', bus_name=serviceName, path='/'),
+		]
+		self.fetch()
+
+	def close(self):
+		for match in self._matches:
+			match.remove()
+		self._matches = []
+		self._callbacks.clear()
+
+	def watch(self, path, callback=None):
+		callbacks = self._callbacks.setdefault(path, [])
+		if callback is not None and callback not in callbacks:
+			callbacks.append(callback)
+		if self._getitems is False and path not in self.values:
+			self._fetch_value(path)
+
+	def unwatch(self, path, callback):
+		callbacks = self._callbacks.get(path, [])
+		if callback in callbacks:
+			callbacks.remove(callback)
+
+	## Fetches all the values of the service, without waiting for the reply
+	def fetch(self):
+		self._bus.call_async(self._serviceName, '/', 'com.victronenergy.BusItem', 'GetItems', '', [],
+			self._items_fetched, self._items_failed)
+
+	## Sets all the values to None, when the service left the bus
+	def invalidate(self):
+		for path in self.values.keys():
+			self._update(path, {'Value': None, 'Text': '---'})
+
+	def _fetch_value(self, path):
+		self._bus.call_async(self._serviceName, path, 'com.victronenergy.BusItem', 'GetValue', '', [],
+			lambda v: self._update(path, {'Value': v}),
+			lambda e: logging.debug("%s%s: GetValue failed: %s" % (self._serviceName, path, e)))
+
+	def _items_fetched(self, items):
+		self._getitems = True
+		for path, changes in items.items():
+			self._update(path, changes)
+		for path in self._callbacks:
+			if path not in items:
+				self._update(path, {'Value': None, 'Text': '---'})
+
+	def _items_failed(self, e):
+		if e.get_dbus_name() == 'org.freedesktop.DBus.Error.ServiceUnknown':
+			# fetched again when the service shows up, see _name_owner_changed
+			return
+		logging.debug("%s: GetItems failed, fetching the values one by one: %s" % (self._serviceName, e))
+		self._getitems = False
+		for path in self._callbacks:
+			self._fetch_value(path)
+
+	def _properties_changed_handler(self, changes, path=None):
+		if "Value" in changes:
+			self._update(path, changes)
+
+	def _items_changed_handler(self, items):
+		for path, changes in items.items():
+			if "Value" in changes:
+				self._update(path, changes)
+
+	def _update(self, path, changes):
+		changes = dict(changes)
+		changes['Value'] = unwrap_dbus_value(changes['Value'])
+		if path in self.values and self.values[path] == changes['Value']:
+			return
+		self.values[path] = changes['Value']
+		for callback in self._callbacks.get(path, []):
+			# see VeDbusItemImport._properties_changed_handler
+			try:
+				callback(self._serviceName, path, changes)
+			except:
+				traceback.print_exc()
+				os._exit(1)
+
 
 class VeDbusTreeExport(dbus.service.Object):
 	def __init__(self, bus, objectPath, get_value_handler):
@@ -348,6 +645,26 @@ class VeDbusTreeExport(dbus.service.Object):
 	def local_get_value(self):
 		return self._get_value_handler(self.path)
 
+class VeDbusRootExport(VeDbusTreeExport):
+	def __init__(self, bus, objectPath, get_value_handler, get_items_handler):
+		VeDbusTreeExport.__init__(self, bus, objectPath, get_value_handler)
+		self._get_items_handler = get_items_handler
+
+	## Dbus exported method GetItems
+	# Returns the Value and Text of all the items of the service in one call,
+	# with their path as the key. Along with ItemsChanged, this lets clients
+	# keep a copy of a whole service without one call per path.
+	@dbus.service.method('com.victronenergy.BusItem', out_signature='a{sa{sv}}')
+	def GetItems(self):
+		return self._get_items_handler()
+
+	## The signal that indicates that several values have changed at once. It
+	# maps the path of each changed item to its Value and Text, like the
+	# changes of PropertiesChanged. Unchanged paths are not included.
+	@dbus.service.signal('com.victronenergy.BusItem', signature='a{sa{sv}}')
+	def ItemsChanged(self, changes):
+		pass
+
 
 class VeDbusItemExport(dbus.service.Object):
 	## Constructor of VeDbusItemExport
@@ -362,11 +679,16 @@ class VeDbusItemExport(dbus.service.Object):
 	# @param callback	  Function that will be called when someone else changes the value of this VeBusItem
 	#                     over the dbus. First parameter passed to callback will be our path, second the new
 	#					  value. This callback should return True to accept the change, False to reject it.
+	# @param signaltext	  Whether the text representation is sent along the value in change signals.
+	# @param changedcallback  Function called with our path whenever the value has changed.
 	def __init__(self, bus, objectPath, value=None, description=None, writeable=False,
-					onchangecallback=None, gettextcallback=None, deletecallback=None):
+					onchangecallback=None, gettextcallback=None, deletecallback=None, signaltext=True,
+					changedcallback=None):
 		dbus.service.Object.__init__(self, bus, objectPath)
 		self._onchangecallback = onchangecallback
+		self._changedcallback = changedcallback
 		self._gettextcallback = gettextcallback
+		self._signaltext = signaltext
 		self._value = value
 		self._description = description
 		self._writeable = writeable
@@ -395,15 +717,25 @@ class VeDbusItemExport(dbus.service.Object):
 	# is using this class to export values to the dbus.
 	# set value to None to indicate that it is Invalid
 	def local_set_value(self, newvalue):
+		changes = self._local_set_value(newvalue)
+		if changes is not None:
+			self.PropertiesChanged(changes)
+
+	## Sets the value without emitting a signal. Returns the changes to be
+	# signalled, or None when the value did not change.
+	def _local_set_value(self, newvalue):
 		if self._value == newvalue:
-			return
+			return None
 
 		self._value = newvalue
+		if self._changedcallback is not None:
+			self._changedcallback(self.__dbus_object_path__)
 
 		changes = {}
 		changes['Value'] = wrap_dbus_value(newvalue)
-		changes['Text'] = self.GetText()
-		self.PropertiesChanged(changes)
+		if self._signaltext:
+			changes['Text'] = self.GetText()
+		return changes
 
 	def local_get_value(self):
 		return self._value
@@ -0,0 +1,32 @@
+# Text representation of the values exported on D-Bus.
+#
+# Formatters are looked up once per path with text_formatter(), when the path
+# is added to the service, instead of testing the path on every GetText.
+
+def _energy_text(path, value):       return ("%.3FkWh" % (float(value) / 1000.0))
+def _power_text(path, value):        return ("%.1FW" % (float(value)))
+def _current_text(path, value):      return ("%.3FA" % (float(value)))
+def _voltage_text(path, value):      return ("%.1FV" % (float(value)))
+def _power_factor_text(path, value): return ("%.2F" % (float(value)))
+def _frequency_text(path, value):    return ("%.1FHz" % (float(value)))
+def _default_text(path, value):      return ("%.0F" % (float(value)))
+
+_POSITIONS = {0: "AC Input 1", 1: "AC Output", 2: "AC Input 2"}
+def position_text(path, value):      return _POSITIONS.get(value, "%.0F" % (float(value)))
+
+TEXT_FORMATTERS = {
+    'Forward':     _energy_text,
+    'Reverse':     _energy_text,
+    'TotalEnergy': _energy_text,
+    'Power':       _power_text,
+    'Current':     _current_text,
+    'Voltage':     _voltage_text,
+    'PowerFactor': _power_factor_text,
+    'Frequency':   _frequency_text,
+}
+
+def text_formatter(path):
+    formatter = TEXT_FORMATTERS.get(path.rsplit('/', 1)[-1])
+    if formatter is not None: return formatter
+    if '/Energy/' in path: return _energy_text
+    return _default_text
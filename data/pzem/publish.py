@@ -0,0 +1,104 @@
+import time
+from contextlib import contextmanager
+
+# Publication policies for the measurements exported on D-Bus.
+#
+# Meters jitter in their last digit all the time, and every change published
+# wakes up systemcalc, the GUI and the VRM logger. A PublishFilter sits in
+# front of a VeDbusService batch and drops the changes that are not worth a
+# signal according to the PublishPolicy of their path.
+
+class PublishPolicy:
+    def __init__(self, deadband=0.0, relative=0.0, min_interval=0.0, max_interval=None, on_change=False):
+        self.deadband = deadband            # absolute change ignored
+        self.relative = relative            # change ignored, relative to the published value
+        self.min_interval = min_interval    # seconds between two publications
+        self.max_interval = max_interval    # seconds after which a change is published anyway
+        self.on_change = on_change          # publish every change immediately (counters)
+
+    def accept(self, value, last, elapsed):
+        if self.on_change:
+            return True
+        if elapsed < self.min_interval:
+            return False
+        if self.max_interval is not None and elapsed >= self.max_interval:
+            return True
+        try:
+            delta = abs(value - last)
+        except TypeError:
+            return True
+        return delta > max(self.deadband, self.relative * abs(last))
+
+PUBLISH_ALWAYS = PublishPolicy()
+
+# Policies of the AC meters, by path basename
+AC_POLICIES = {
+    'Voltage':     PublishPolicy(deadband=0.5, max_interval=60),
+    'Frequency':   PublishPolicy(deadband=0.1, max_interval=60),
+    'Current':     PublishPolicy(deadband=0.01, relative=0.01, max_interval=60),
+    'Power':       PublishPolicy(deadband=1.0, relative=0.005, max_interval=60),
+    'PowerFactor': PublishPolicy(deadband=0.01, max_interval=60),
+    'Forward':     PublishPolicy(on_change=True),
+    'Reverse':     PublishPolicy(on_change=True),
+    'TotalEnergy': PublishPolicy(on_change=True),
+}
+
+# Policies by device type, see DbusPzemService
+PUBLISH_POLICIES = {
+    'grid':      AC_POLICIES,
+    'inverter0': AC_POLICIES,
+    'inverter':  AC_POLICIES,
+    'pzem-016':  AC_POLICIES,
+}
+
+class PublishFilter:
+    def __init__(self, policies=None):
+        self.policies = policies or {}
+        self.emitted = 0
+        self.suppressed = 0
+        self._path_policies = {}
+        self._published = {}    # path -> time of the last publication
+
+    def policy(self, path):
+        p = self._path_policies.get(path)
+        if p is None:
+            p = self._path_policies[path] = self.policies.get(path.rsplit('/', 1)[-1], PUBLISH_ALWAYS)
+        return p
+
+    ## Tells whether value is worth publishing at path. It is compared with
+    # current, the value the service exports at path, which may also have been
+    # set outside of the filter, as error() does.
+    def accept(self, path, value, current, now):
+        if value == current:
+            return False
+        t = self._published.get(path)
+        if t is not None and not self.policy(path).accept(value, current, now - t):
+            self.suppressed += 1
+            return False
+        self._published[path] = now
+        self.emitted += 1
+        return True
+
+    @contextmanager
+    def batch(self, service):
+        ''' a batch on the VeDbusService that only lets through the accepted changes '''
+        with service as s:
+            yield _FilteredContext(self, s, time.time())
+
+    def __repr__(self):
+        total = self.emitted + self.suppressed
+        return "%d updates emitted, %d suppressed (%.0f%%)" % (
+            self.emitted, self.suppressed, 100.0 * self.suppressed / max(total, 1))
+
+class _FilteredContext:
+    def __init__(self, publish, context, now):
+        self._publish = publish
+        self._context = context
+        self._now = now
+
+    def __getitem__(self, path):
+        return self._context[path]
+
+    def __setitem__(self, path, value):
+        if self._publish.accept(path, value, self._context[path], self._now):
+            self._context[path] = value
@@ -0,0 +1,149 @@
+#!/usr/bin/env python2
+
+# Micro-benchmarks of the PZEM driver hot paths. They do not need a device:
+# Modbus responses are synthesized and fed to the instrument in place of the
+# serial port. Run them on the GX itself to get meaningful numbers.
+
+import itertools
+import os
+import random
+import struct
+import time
+
+import formatting
+import minimalmodbus
+import pzem
+import rtu
+
+class ReplayInstrument(minimalmodbus.Instrument):
+    ''' An instrument answering every request with the next canned response '''
+    def __init__(self, address, responses):
+        self.address = address
+        self.mode = minimalmodbus.MODE_RTU
+        self.precalculate_read_size = True
+        self.debug = False
+        self.responses = responses
+        self.index = 0
+
+    def _communicate(self, request, number_of_bytes_to_read):
+        response = self.responses[self.index]
+        self.index = (self.index + 1) % len(self.responses)
+        return response
+
+def ac_frame(address):
+    ''' a random read input registers response of a PZEM-016 '''
+    registers = [random.randint(2200, 2400), random.randint(0, 65535), random.randint(0, 1),
+                 random.randint(0, 65535), random.randint(0, 1), random.randint(0, 65535),
+                 random.randint(0, 10), random.randint(495, 505), random.randint(0, 100), 0]
+    frame = struct.pack(">BBB10H", address, 0x04, 20, *registers)
+    return frame + minimalmodbus._calculate_crc_string(frame)
+
+def timeit(name, func, n):
+    start = time.time()
+    for _ in range(n):
+        func()
+    elapsed = time.time() - start
+    print("%-28s %8.1f us/frame" % (name, 1e6 * elapsed / n))
+    return elapsed
+
+def decode_dict(data):
+    ''' the decoding of pzem.ac_readings, from a list of registers '''
+    return {
+        "voltage":    round((data[0]*0.1),1),
+        "current":    round((data[2]*65536+data[1]*0.001),3),
+        "power":      round((data[4]*65536+data[3]*0.1),1),
+        "energy":     round((data[6]*65536+data[5]*1),0),
+        "frequency":  round((data[7]*0.1),1),
+        "pow_factor": round((data[8]*0.01),1),
+        "alarm_pow":  data[9] != 0,
+    }
+
+def bench_readings(n):
+    ''' dict based readings against the struct decoded reading record '''
+    frames = [ac_frame(1) for _ in range(1000)]
+    inst = ReplayInstrument(1, frames)
+    payloads = itertools.cycle([pzem.read_input_registers(inst, 0, 10) for _ in frames])
+
+    print("Decoding %d PZEM-016 payloads" % n)
+    old = timeit("valuelist + dict", lambda: decode_dict(minimalmodbus._bytestring_to_valuelist(next(payloads)[1:], 10)), n)
+    new = timeit("struct + record", lambda: pzem.decode_ac(next(payloads)), n)
+    print("decoding speedup: x%.1f" % (old / new))
+
+    print("Reading %d PZEM-016 frames (framing, CRC and decoding)" % n)
+    old = timeit("ac_readings", lambda: pzem.ac_readings(inst), n)
+    new = timeit("read_ac", lambda: pzem.read_ac(inst), n)
+    print("read speedup: x%.1f" % (old / new))
+
+def bench_framing(n):
+    ''' string based CRC and framing of minimalmodbus against the cached bytes frames '''
+    response = ac_frame(1)
+    request = struct.pack(">BBHH", 1, 0x04, 0, 10)
+
+    print("CRC-16 of %d PZEM-016 responses (%d bytes)" % (n, len(response)))
+    old = timeit("_calculate_crc_string", lambda: minimalmodbus._calculate_crc_string(response[:-2]), n)
+    new = timeit("rtu.crc16_table", lambda: rtu.crc16_table(response), n)
+    print("speedup: x%.1f" % (old / new))
+    if rtu.crc16 is not rtu.crc16_table:
+        new = timeit("rtu.crc16 (crcmod)", lambda: rtu.crc16(response), n)
+        print("speedup: x%.1f" % (old / new))
+
+    print("Building %d read input registers requests" % n)
+    old = timeit("_embed_payload", lambda: minimalmodbus._embed_payload(1, minimalmodbus.MODE_RTU, 0x04, request[2:]), n)
+    new = timeit("rtu.request_frame", lambda: rtu.request_frame(1, 0x04, 0, 10), n)
+    print("speedup: x%.1f" % (old / new))
+
+    print("Checking %d responses" % n)
+    old = timeit("_extract_payload", lambda: minimalmodbus._extract_payload(response, 1, minimalmodbus.MODE_RTU, 0x04), n)
+    new = timeit("rtu.check_response", lambda: rtu.check_response(response, 1, 0x04), n)
+    print("speedup: x%.1f" % (old / new))
+
+def get_text_chain(path, value):
+    ''' the former _get_text of DbusPzemGridMeterService '''
+    if path == "/ErrorCode": return ""
+    elif os.path.basename(path) == "Forward":     return ("%.3FkWh" % (float(value) / 1000.0))
+    elif os.path.basename(path) == "Reverse":     return ("%.3FkWh" % (float(value) / 1000.0))
+    elif os.path.basename(path) == "Power":       return ("%.1FW" % (float(value)))
+    elif os.path.basename(path) == "Current":     return ("%.3FA" % (float(value)))
+    elif os.path.basename(path) == "Voltage":     return ("%.1FV" % (float(value)))
+    elif os.path.basename(path) == "PowerFactor": return ("%.2F" % (float(value)))
+    elif os.path.basename(path) == "Frequency":   return ("%.1FHz" % (float(value)))
+    else: return ("%.0F" % (float(value)))
+
+GRID_READINGS = ['/Ac/Energy/Forward', '/Ac/Energy/Reverse', '/Ac/Power', '/Ac/Current', '/Ac/Voltage',
+    '/Ac/L1/Current', '/Ac/L1/Energy/Forward', '/Ac/L1/Energy/Reverse', '/Ac/L1/Power', '/Ac/L1/Voltage',
+    '/Ac/L1/Frequency', '/Ac/L1/PowerFactor']
+
+def bench_text(n):
+    ''' text of the changes signalled for one update of a grid meter '''
+    values = [(path, random.uniform(0, 1000)) for path in GRID_READINGS]
+    resolved = [(path, value, formatting.text_formatter(path)) for path, value in values]
+
+    def chain():
+        return [{'Value': value, 'Text': get_text_chain(path, value)} for path, value in values]
+    def dispatch():
+        return [{'Value': value, 'Text': fmt(path, value)} for path, value, fmt in resolved]
+    def notext():
+        return [{'Value': value} for path, value in values]
+
+    print("Building the changes of %d updates of %d readings" % (n, len(values)))
+    old = timeit("_get_text chain", chain, n)
+    new = timeit("resolved formatter", dispatch, n)
+    print("speedup: x%.1f" % (old / new))
+    new = timeit("no text (--no-signal-text)", notext, n)
+    print("speedup: x%.1f" % (old / new))
+
+BENCHMARKS = {
+    'framing': bench_framing,
+    'readings': bench_readings,
+    'text': bench_text,
+}
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options] [BENCHMARK...]")
+    parser.add_option("-n", "--number", dest="number", type="int", default=10000,
+                      help="number of iterations", metavar="N")
+    (opts, args) = parser.parse_args()
+
+    for name in (args or sorted(BENCHMARKS)):
+        BENCHMARKS[name](opts.number)
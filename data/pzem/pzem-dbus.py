@@ -15,28 +15,40 @@ import argparse
 import logging
 import sys
 import os
-import pzem
 import dbus
 import dbus.service
 
 import pzem
 import time
+from scheduler import BusScheduler
+from transport import SyncTransport, ThreadTransport
+from publish import PublishFilter, PUBLISH_POLICIES
+from formatting import text_formatter, position_text
 
 # our own packages
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'ext/velib_python'))
-from vedbus import VeDbusService, VeDbusItemImport
+from vedbus import VeDbusService, VeDbusImportManager
 
 softwareVersion = '0.1'
 
 AC_INPUT=0
 AC_OUTPUT=1
 
+# Seconds without a successful poll before a service reports /Connected = 0,
+# whatever the backoff of the polls of an unresponsive slave
+DISCONNECT_TIMEOUT = 60
+
+# Readings get the text formatter of their path, resolved once
+def add_reading(dbusservice, path, value=0):
+    dbusservice.add_path(path, value, gettextcallback=text_formatter(path))
+
 class DbusPzemInverterService:
-    def __init__(self, devname, address, position=AC_OUTPUT):
+    def __init__(self, devname, address, position=AC_OUTPUT, policies=None, signaltext=True):
         bus = (dbus.SessionBus(private=True) if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus(private=True))
-        self._dbusservice = VeDbusService("com.victronenergy.pvinverter.pzem-%s-%d" % (devname, address), bus=bus)
+        self._dbusservice = VeDbusService("com.victronenergy.pvinverter.pzem-%s-%d" % (devname, address), bus=bus, signaltext=signaltext)
         self._error_message = ""
-        self._disconnect = 0
+        self._last_update = time.time()   # of the last successful poll, see DISCONNECT_TIMEOUT
+        self._publish = PublishFilter(policies)
 
         pre = ''
 
@@ -54,77 +66,67 @@ class DbusPzemInverterService:
         self._dbusservice.add_path(pre+'/Connected', 0)
 
         # Readings
-        self._dbusservice.add_path(pre+'/Ac/Energy/Forward', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/Power', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/Current', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/Voltage', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L1/Current', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L1/Energy/Forward', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L1/Power', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L1/Voltage', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L1/Frequency', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L1/PowerFactor', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L2/Current', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L2/Energy/Forward', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L2/Power', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L2/Voltage', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L3/Current', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L3/Energy/Forward', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Ac/L3/Power', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path(pre+'/Position', position)
+        add_reading(self._dbusservice, pre+'/Ac/Energy/Forward')
+        add_reading(self._dbusservice, pre+'/Ac/Power')
+        add_reading(self._dbusservice, pre+'/Ac/Current')
+        add_reading(self._dbusservice, pre+'/Ac/Voltage')
+        add_reading(self._dbusservice, pre+'/Ac/L1/Current')
+        add_reading(self._dbusservice, pre+'/Ac/L1/Energy/Forward')
+        add_reading(self._dbusservice, pre+'/Ac/L1/Power')
+        add_reading(self._dbusservice, pre+'/Ac/L1/Voltage')
+        add_reading(self._dbusservice, pre+'/Ac/L1/Frequency')
+        add_reading(self._dbusservice, pre+'/Ac/L1/PowerFactor')
+        add_reading(self._dbusservice, pre+'/Ac/L2/Current')
+        add_reading(self._dbusservice, pre+'/Ac/L2/Energy/Forward')
+        add_reading(self._dbusservice, pre+'/Ac/L2/Power')
+        add_reading(self._dbusservice, pre+'/Ac/L2/Voltage')
+        add_reading(self._dbusservice, pre+'/Ac/L3/Current')
+        add_reading(self._dbusservice, pre+'/Ac/L3/Energy/Forward')
+        add_reading(self._dbusservice, pre+'/Ac/L3/Power')
+        self._dbusservice.add_path(pre+'/Position', position, gettextcallback=position_text)
         self._dbusservice.add_path(pre+'/StatusCode', 7)
         self._dbusservice.add_path(pre+'/DeviceType', "PZEM-016")
-        self._dbusservice.add_path(pre+'/ErrorCode', 0, gettextcallback=self._get_text)
+        self._dbusservice.add_path(pre+'/ErrorCode', 0, gettextcallback=self._get_error_text)
         self._dbusservice.add_path(pre+'/ErrorMessage', "")
 
-    def update(self, instr):
+    def update(self, r):
         pre = ''
-        try:
-            r = instr.readings()
-            self._dbusservice[pre+'/Ac/Energy/Forward']    = r['energy']
-            self._dbusservice[pre+'/Ac/Power']             = r['power']
-            self._dbusservice[pre+'/Ac/Current']           = r['current']
-            self._dbusservice[pre+'/Ac/Voltage']           = r['voltage']
-            self._dbusservice[pre+'/Ac/L1/Current']        = r['current']
-            self._dbusservice[pre+'/Ac/L1/Energy/Forward'] = r['energy']
-            self._dbusservice[pre+'/Ac/L1/Power']          = r['power']
-            self._dbusservice[pre+'/Ac/L1/Voltage']        = r['voltage']
-            self._dbusservice[pre+'/Ac/L1/Frequency']      = r['frequency']
-            self._dbusservice[pre+'/Ac/L1/PowerFactor']    = r['pow_factor']
-            self._dbusservice[pre+'/ErrorCode']            = 0
-            self._dbusservice[pre+'/ErrorMessage']         = ""
-            self._dbusservice[pre+'/Connected']            = 1
-            self._error_message = ""
-        except Exception as e:
-            self._dbusservice[pre+'/ErrorCode']            = 1
-            self._dbusservice[pre+'/ErrorMessage']         = str(e)
-            if self._disconnect > 60:
-                self._dbusservice[pre+'/Connected']        = 0
-            self._disconnect += 1
-            self._error_message = str(e)
-
-    def _get_text(self, path, value):
+        self._error_message = ""
+        with self._publish.batch(self._dbusservice) as s:
+            s[pre+'/Ac/Energy/Forward']    = r['energy']
+            s[pre+'/Ac/Power']             = r['power']
+            s[pre+'/Ac/Current']           = r['current']
+            s[pre+'/Ac/Voltage']           = r['voltage']
+            s[pre+'/Ac/L1/Current']        = r['current']
+            s[pre+'/Ac/L1/Energy/Forward'] = r['energy']
+            s[pre+'/Ac/L1/Power']          = r['power']
+            s[pre+'/Ac/L1/Voltage']        = r['voltage']
+            s[pre+'/Ac/L1/Frequency']      = r['frequency']
+            s[pre+'/Ac/L1/PowerFactor']    = r['pow_factor']
+            s[pre+'/ErrorCode']            = 0
+            s[pre+'/ErrorMessage']         = ""
+            s[pre+'/Connected']            = 1
+        self._last_update = time.time()
+
+    def error(self, e):
         pre = ''
-        if path == pre+"/ErrorCode": return self._error_message
-        if path == pre+"/Position":
-            if value == 0: return "AC Input 1"
-            if value == 1: return "AC Output"
-            if value == 2: return "AC Input 2"
-        if os.path.basename(path) == "Forward":     return ("%.3FkWh" % (float(value) / 1000.0))
-        if os.path.basename(path) == "Reverse":     return ("%.3FkWh" % (float(value) / 1000.0))
-        if os.path.basename(path) == "Power":       return ("%.1FW" % (float(value)))
-        if os.path.basename(path) == "Current":     return ("%.3FA" % (float(value)))
-        if os.path.basename(path) == "Voltage":     return ("%.1FV" % (float(value)))
-        if os.path.basename(path) == "PowerFactor": return ("%.2F" % (float(value)))
-        if os.path.basename(path) == "Frequency":   return ("%.1FHz" % (float(value)))
-        return ("%.0F" % (float(value)))
+        self._error_message = str(e)
+        with self._dbusservice as s:
+            s[pre+'/ErrorCode']            = 1
+            s[pre+'/ErrorMessage']         = str(e)
+            if time.time() - self._last_update > DISCONNECT_TIMEOUT:
+                s[pre+'/Connected']        = 0
+
+    def _get_error_text(self, path, value):
+        return self._error_message
 
 class DbusPzemGridMeterService:
-    def __init__(self, devname, address):
+    def __init__(self, devname, address, policies=None, signaltext=True):
         bus = (dbus.SessionBus(private=True) if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus(private=True))
-        self._dbusservice = VeDbusService("com.victronenergy.grid.pzem_%s_%d" % (devname, address))
+        self._dbusservice = VeDbusService("com.victronenergy.grid.pzem_%s_%d" % (devname, address), signaltext=signaltext)
         self._error_message = ""
-        self._disconnect = 0
+        self._last_update = time.time()   # of the last successful poll, see DISCONNECT_TIMEOUT
+        self._publish = PublishFilter(policies)
 
         # Create the management objects, as specified in the ccgx dbus-api document
         self._dbusservice.add_path('/Mgmt/ProcessName', __file__)
@@ -140,74 +142,68 @@ class DbusPzemGridMeterService:
         self._dbusservice.add_path('/Connected', 0)
 
         # Readings
-        self._dbusservice.add_path('/Ac/Energy/Forward', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/Energy/Reverse', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/Power', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/Current', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/Voltage', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L1/Current', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L1/Energy/Forward', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L1/Energy/Reverse', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L1/Power', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L1/Voltage', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L1/Frequency', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L1/PowerFactor', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L2/Current', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L2/Energy/Forward', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L2/Energy/Reverse', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L2/Power', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L2/Voltage', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L3/Current', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L3/Energy/Forward', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L3/Energy/Reverse', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/L3/Power', 0, gettextcallback=self._get_text)
+        add_reading(self._dbusservice, '/Ac/Energy/Forward')
+        add_reading(self._dbusservice, '/Ac/Energy/Reverse')
+        add_reading(self._dbusservice, '/Ac/Power')
+        add_reading(self._dbusservice, '/Ac/Current')
+        add_reading(self._dbusservice, '/Ac/Voltage')
+        add_reading(self._dbusservice, '/Ac/L1/Current')
+        add_reading(self._dbusservice, '/Ac/L1/Energy/Forward')
+        add_reading(self._dbusservice, '/Ac/L1/Energy/Reverse')
+        add_reading(self._dbusservice, '/Ac/L1/Power')
+        add_reading(self._dbusservice, '/Ac/L1/Voltage')
+        add_reading(self._dbusservice, '/Ac/L1/Frequency')
+        add_reading(self._dbusservice, '/Ac/L1/PowerFactor')
+        add_reading(self._dbusservice, '/Ac/L2/Current')
+        add_reading(self._dbusservice, '/Ac/L2/Energy/Forward')
+        add_reading(self._dbusservice, '/Ac/L2/Energy/Reverse')
+        add_reading(self._dbusservice, '/Ac/L2/Power')
+        add_reading(self._dbusservice, '/Ac/L2/Voltage')
+        add_reading(self._dbusservice, '/Ac/L3/Current')
+        add_reading(self._dbusservice, '/Ac/L3/Energy/Forward')
+        add_reading(self._dbusservice, '/Ac/L3/Energy/Reverse')
+        add_reading(self._dbusservice, '/Ac/L3/Power')
         self._dbusservice.add_path('/DeviceType', "PZEM-016")
-        self._dbusservice.add_path('/ErrorCode', 0, gettextcallback=self._get_text)
+        self._dbusservice.add_path('/ErrorCode', 0, gettextcallback=self._get_error_text)
         self._dbusservice.add_path('/ErrorMessage', "")
 
-    def update(self, instr):
-        try:
-            r = instr.readings()
-            self._dbusservice['/Ac/Energy/Forward']    = r['energy']
-            self._dbusservice['/Ac/Power']             = r['power']
-            self._dbusservice['/Ac/Current']           = r['current']
-            self._dbusservice['/Ac/Voltage']           = r['voltage']
-            self._dbusservice['/Ac/L1/Current']        = r['current']
-            self._dbusservice['/Ac/L1/Energy/Forward'] = r['energy']
-            self._dbusservice['/Ac/L1/Power']          = r['power']
-            self._dbusservice['/Ac/L1/Voltage']        = r['voltage']
-            self._dbusservice['/Ac/L1/Frequency']      = r['frequency']
-            self._dbusservice['/Ac/L1/PowerFactor']    = r['pow_factor']
-            self._dbusservice['/ErrorCode']            = 0
-            self._dbusservice['/ErrorMessage']         = ""
-            self._dbusservice['/Connected']            = 1
-            self._error_message = ""
-        except Exception as e:
-            self._dbusservice['/ErrorCode']            = 1
-            self._dbusservice['/ErrorMessage']         = str(e)
-            if self._disconnect > 60:
-                self._dbusservice['/Connected']        = 0
-            self._disconnect += 1
-            self._error_message = str(e)
-
-    def _get_text(self, path, value):
-        if path == "/ErrorCode": return self._error_message
-        elif os.path.basename(path) == "Forward":     return ("%.3FkWh" % (float(value) / 1000.0))
-        elif os.path.basename(path) == "Reverse":     return ("%.3FkWh" % (float(value) / 1000.0))
-        elif os.path.basename(path) == "Power":       return ("%.1FW" % (float(value)))
-        elif os.path.basename(path) == "Current":     return ("%.3FA" % (float(value)))
-        elif os.path.basename(path) == "Voltage":     return ("%.1FV" % (float(value)))
-        elif os.path.basename(path) == "PowerFactor": return ("%.2F" % (float(value)))
-        elif os.path.basename(path) == "Frequency":   return ("%.1FHz" % (float(value)))
-        else: return ("%.0F" % (float(value)))
+    def update(self, r):
+        self._error_message = ""
+        with self._publish.batch(self._dbusservice) as s:
+            s['/Ac/Energy/Forward']    = r['energy']
+            s['/Ac/Power']             = r['power']
+            s['/Ac/Current']           = r['current']
+            s['/Ac/Voltage']           = r['voltage']
+            s['/Ac/L1/Current']        = r['current']
+            s['/Ac/L1/Energy/Forward'] = r['energy']
+            s['/Ac/L1/Power']          = r['power']
+            s['/Ac/L1/Voltage']        = r['voltage']
+            s['/Ac/L1/Frequency']      = r['frequency']
+            s['/Ac/L1/PowerFactor']    = r['pow_factor']
+            s['/ErrorCode']            = 0
+            s['/ErrorMessage']         = ""
+            s['/Connected']            = 1
+        self._last_update = time.time()
+
+    def error(self, e):
+        self._error_message = str(e)
+        with self._dbusservice as s:
+            s['/ErrorCode']            = 1
+            s['/ErrorMessage']         = str(e)
+            if time.time() - self._last_update > DISCONNECT_TIMEOUT:
+                s['/Connected']        = 0
+
+    def _get_error_text(self, path, value):
+        return self._error_message
 
 class DbusPzem016Service:
-    def __init__(self, devname, address):
+    def __init__(self, devname, address, policies=None, signaltext=True):
         bus = (dbus.SessionBus(private=True) if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus(private=True))
         self._dbusname = "fr.mildred.pzemvictron2020.pzem016.%s-%d" % (devname, address)
-        self._dbusservice = VeDbusService(self._dbusname, bus=bus)
+        self._dbusservice = VeDbusService(self._dbusname, bus=bus, signaltext=signaltext)
         self._error_message = ""
-        self._disconnect = 0
+        self._last_update = time.time()   # of the last successful poll, see DISCONNECT_TIMEOUT
+        self._publish = PublishFilter(policies)
 
         # Create the management objects, as specified in the ccgx dbus-api document
         self._dbusservice.add_path('/Mgmt/ProcessName', __file__)
@@ -223,53 +219,47 @@ class DbusPzem016Service:
         self._dbusservice.add_path('/Connected', 0)
 
         # Readings
-        self._dbusservice.add_path('/Ac/Current', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/TotalEnergy', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/Power', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/Voltage', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/Frequency', 0, gettextcallback=self._get_text)
-        self._dbusservice.add_path('/Ac/PowerFactor', 0, gettextcallback=self._get_text)
+        add_reading(self._dbusservice, '/Ac/Current')
+        add_reading(self._dbusservice, '/Ac/TotalEnergy')
+        add_reading(self._dbusservice, '/Ac/Power')
+        add_reading(self._dbusservice, '/Ac/Voltage')
+        add_reading(self._dbusservice, '/Ac/Frequency')
+        add_reading(self._dbusservice, '/Ac/PowerFactor')
         self._dbusservice.add_path('/DeviceType', "PZEM-016")
-        self._dbusservice.add_path('/ErrorCode', 0, gettextcallback=self._get_text)
+        self._dbusservice.add_path('/ErrorCode', 0, gettextcallback=self._get_error_text)
         self._dbusservice.add_path('/ErrorMessage', "")
 
-    def update(self, instr):
-        try:
-            #print("Updating %s" % self._dbusname)
-            r = instr.readings()
-            self._dbusservice['/Ac/TotalEnergy']    = r['energy']
-            self._dbusservice['/Ac/Power']          = r['power']
-            self._dbusservice['/Ac/Current']        = r['current']
-            self._dbusservice['/Ac/Voltage']        = r['voltage']
-            self._dbusservice['/Ac/Frequency']      = r['frequency']
-            self._dbusservice['/Ac/PowerFactor']    = r['pow_factor']
-            self._dbusservice['/ErrorCode']         = 0
-            self._dbusservice['/ErrorMessage']      = ""
-            self._dbusservice['/Connected']         = 1
-            self._error_message = ""
-        except Exception as e:
-            #print("%s error: %s" % (self._dbusname, e))
-            self._dbusservice['/ErrorCode']         = 1
-            self._dbusservice['/ErrorMessage']      = str(e)
-            if self._disconnect > 60:
-                self._dbusservice['/Connected']     = 0
-            self._disconnect += 1
-            self._error_message = str(e)
-
-    def _get_text(self, path, value):
-        if path == "/ErrorCode": return self._error_message
-        elif os.path.basename(path) == "TotalEnergy": return ("%.3FkWh" % (float(value) / 1000.0))
-        elif os.path.basename(path) == "Power":       return ("%.1FW" % (float(value)))
-        elif os.path.basename(path) == "Current":     return ("%.3FA" % (float(value)))
-        elif os.path.basename(path) == "Voltage":     return ("%.1FV" % (float(value)))
-        elif os.path.basename(path) == "PowerFactor": return ("%.2F" % (float(value)))
-        elif os.path.basename(path) == "Frequency":   return ("%.1FHz" % (float(value)))
-        else: return ("%.0F" % (float(value)))
+    def update(self, r):
+        #print("Updating %s" % self._dbusname)
+        self._error_message = ""
+        with self._publish.batch(self._dbusservice) as s:
+            s['/Ac/TotalEnergy']    = r['energy']
+            s['/Ac/Power']          = r['power']
+            s['/Ac/Current']        = r['current']
+            s['/Ac/Voltage']        = r['voltage']
+            s['/Ac/Frequency']      = r['frequency']
+            s['/Ac/PowerFactor']    = r['pow_factor']
+            s['/ErrorCode']         = 0
+            s['/ErrorMessage']      = ""
+            s['/Connected']         = 1
+        self._last_update = time.time()
+
+    def error(self, e):
+        #print("%s error: %s" % (self._dbusname, e))
+        self._error_message = str(e)
+        with self._dbusservice as s:
+            s['/ErrorCode']         = 1
+            s['/ErrorMessage']      = str(e)
+            if time.time() - self._last_update > DISCONNECT_TIMEOUT:
+                s['/Connected']     = 0
+
+    def _get_error_text(self, path, value):
+        return self._error_message
 
 class DbusMockMultiplusService:
     def __init__(self, devname, address):
-        self.imported = {}
         self.bus = (dbus.SessionBus(private=True) if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus(private=True))
+        self.imports = VeDbusImportManager.get(self.bus)
         self._dbusservice = VeDbusService("com.victronenergy.vebus.mock-multiplus-%s-%s" % (devname, address), bus=self.bus)
         self.bus.add_signal_receiver(self.dbus_name_owner_changed, signal_name='NameOwnerChanged')
 
@@ -279,7 +269,7 @@ class DbusMockMultiplusService:
         logging.info('Finished search for vebus devices')
 
         self._error_message = ""
-        self._disconnect = 0
+        self._last_update = time.time()   # of the last successful poll, see DISCONNECT_TIMEOUT
 
         # Create the management objects, as specified in the ccgx dbus-api document
         self._dbusservice.add_path('/Mgmt/ProcessName', __file__)
@@ -295,26 +285,24 @@ class DbusMockMultiplusService:
         self._dbusservice.add_path('/Connected', 0)
 
         # Readings
-        self._dbusservice.add_path('/Energy/InverterToAcOut', 0, gettextcallback=self._get_text)
+        add_reading(self._dbusservice, '/Energy/InverterToAcOut')
         self._dbusservice.add_path('/DeviceType', "MockMultiplus")
-        self._dbusservice.add_path('/ErrorCode', 0, gettextcallback=self._get_text)
+        self._dbusservice.add_path('/ErrorCode', 0, gettextcallback=self._get_error_text)
         self._dbusservice.add_path('/ErrorMessage', "")
 
-    def update(self, _instr):
-        try:
-            pass
-        except Exception as e:
-            self._dbusservice['/ErrorCode']         = 1
-            self._dbusservice['/ErrorMessage']      = str(e)
-            if self._disconnect > 60:
-                self._dbusservice['/Connected']     = 0
-            self._disconnect += 1
-            self._error_message = str(e)
-
-    def _get_text(self, path, value):
-        if path == "/ErrorCode": return self._error_message
-        elif path.startswith("/Energy/"): return ("%.3FkWh" % (float(value) / 1000.0))
-        else: return ("%.0F" % (float(value)))
+    def update(self, _r):
+        pass
+
+    def error(self, e):
+        self._error_message = str(e)
+        with self._dbusservice as s:
+            s['/ErrorCode']         = 1
+            s['/ErrorMessage']      = str(e)
+            if time.time() - self._last_update > DISCONNECT_TIMEOUT:
+                s['/Connected']     = 0
+
+    def _get_error_text(self, path, value):
+        return self._error_message
 
     def dbus_name_owner_changed(self, name, oldOwner, newOwner):
         # decouple, and process in main loop
@@ -340,9 +328,7 @@ class DbusMockMultiplusService:
             #self.import_value(serviceName, '/TimeToGo')
 
     def import_value(self, serviceName, path):
-        if serviceName not in self.imported: self.imported[serviceName] = {}
-        if path in self.imported[serviceName]: return
-        self.imported[serviceName][path] = VeDbusItemImport(self.bus, serviceName, path, self.import_value_changed)
+        self.imports.watch(serviceName, path, self.import_value_changed)
 
     def import_value_changed(self, serviceName, path, changes):
         if self.is_service_battery(serviceName):
@@ -353,36 +339,53 @@ class DbusMockMultiplusService:
 
 
 class DbusPzemService:
-    def __init__(self, tty, devices):
+    def __init__(self, tty, devices, threaded=True, signaltext=True):
         self._services = {}
         self._instruments = {}
+        self._transport = ThreadTransport(tty) if threaded else SyncTransport(tty)
+        self._scheduler = BusScheduler(tty, self._transport)
         devname = os.path.basename(tty)
 
         for addr in devices:
-            if devices[addr] == 'grid':
-                self._services[addr] = DbusPzemGridMeterService(devname, addr)
+            # A device is either described by its type, or by a dict with its
+            # type and optional polling interval (seconds), priority and
+            # publication policies (see publish.py)
+            device = devices[addr]
+            if not isinstance(device, dict): device = {'type': device}
+            typ = device['type']
+            policies = device.get('publish', PUBLISH_POLICIES.get(typ))
+            if typ == 'grid':
+                self._services[addr] = DbusPzemGridMeterService(devname, addr, policies=policies, signaltext=signaltext)
                 self._instruments[addr] = pzem.Instrument(tty, addr, 'ac')
-            elif devices[addr] == 'inverter0':
-                self._services[addr] = DbusPzemInverterService(devname, addr, position=AC_INPUT)
+            elif typ == 'inverter0':
+                self._services[addr] = DbusPzemInverterService(devname, addr, position=AC_INPUT, policies=policies, signaltext=signaltext)
                 self._instruments[addr] = pzem.Instrument(tty, addr, 'ac')
-            elif devices[addr] == 'inverter':
-                self._services[addr] = DbusPzemInverterService(devname, addr)
+            elif typ == 'inverter':
+                self._services[addr] = DbusPzemInverterService(devname, addr, policies=policies, signaltext=signaltext)
                 self._instruments[addr] = pzem.Instrument(tty, addr, 'ac')
-            elif devices[addr] == 'pzem-016':
-                self._services[addr] = DbusPzem016Service(devname, addr)
+            elif typ == 'pzem-016':
+                self._services[addr] = DbusPzem016Service(devname, addr, policies=policies, signaltext=signaltext)
                 self._instruments[addr] = pzem.Instrument(tty, addr, 'ac')
-            elif devices[addr] == 'mock-multiplus':
+            elif typ == 'mock-multiplus':
                 self._services[addr] = DbusMockMultiplusService(devname, addr)
                 self._instruments[addr] = None
             else:
-                raise Exception("Unknown device type %s" % devices[addr])
+                raise Exception("Unknown device type %s" % typ)
 
-        gobject.timeout_add(1000, self._update)
+            service, instr = self._services[addr], self._instruments[addr]
+            if instr is not None:
+                self._scheduler.add_job("%s-%s" % (devname, addr), instr.readings,
+                    service.update, service.error,
+                    interval=device.get('interval', 1.0),
+                    priority=device.get('priority', 0))
 
-    def _update(self):
+        gobject.timeout_add_seconds(300, self._log_stats)
+
+    def _log_stats(self):
         for addr in self._services:
-            service, instr = self._services[addr], self._instruments[addr]
-            service.update(instr)
+            publish = getattr(self._services[addr], '_publish', None)
+            if publish is not None:
+                logging.info("%s: %r" % (addr, publish))
         return True
 
 # === All code below is to simply run it from the commandline for debugging purposes ===
@@ -408,12 +411,21 @@ def main():
                       help="change device address", metavar="ADDRESS")
     parser.add_option("-t", "--type", dest="type",
                       help="Type (ac, dc)", metavar="TYPE")
+    parser.add_option("--sync", dest="sync", action="store_true",
+                      help="perform Modbus I/O in the main loop instead of a dedicated thread")
+    parser.add_option("--no-signal-text", dest="signaltext", action="store_false", default=True,
+                      help="do not send the text of the values in change signals, clients call GetText")
     parser.add_option("--debug", dest="debug", action="store_true", help="set logging level to debug")
     (opts, args) = parser.parse_args()
 
     logging.basicConfig(level=(logging.DEBUG if opts.debug else logging.INFO))
 
-    from dbus.mainloop.glib import DBusGMainLoop
+    from dbus.mainloop.glib import DBusGMainLoop, threads_init
+
+    # Modbus I/O runs in its own thread and hands its results to the main loop
+    if not opts.sync:
+        gobject.threads_init()
+        threads_init()
 
     # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
     DBusGMainLoop(set_as_default=True)
@@ -424,7 +436,9 @@ def main():
             #10: "pzem-016",
             20: "pzem-016",
             'MultiPlus': "mock-multiplus"
-        })
+        },
+        threaded=not opts.sync,
+        signaltext=opts.signaltext)
 
     logging.info("Starting mainloop, responding only on events")
     mainloop = gobject.MainLoop()
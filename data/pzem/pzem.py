@@ -1,4 +1,6 @@
 import minimalmodbus
+import rtu
+import struct
 
 def instrument(serial, address):
     inst = minimalmodbus.Instrument(serial, address, debug=False)
@@ -56,6 +58,73 @@ def ac_readings(inst):
         "alarm_pow":  data[9] != 0,
     }
 
+# Fast path: read all input registers in one request and decode the raw
+# response payload with a single struct call into a reading record.
+
+_AC_REGISTERS = struct.Struct(">10H")
+_DC_REGISTERS = struct.Struct(">8H")
+
+class AcReading(object):
+    __slots__ = ("voltage", "current", "power", "energy", "frequency", "pow_factor", "alarm_pow")
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return "AcReading(%s)" % ", ".join("%s=%r" % (k, getattr(self, k)) for k in self.__slots__)
+
+class DcReading(object):
+    __slots__ = ("voltage", "current", "power", "energy", "alarm_hiv", "alarm_lov")
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return "DcReading(%s)" % ", ".join("%s=%r" % (k, getattr(self, k)) for k in self.__slots__)
+
+def read_input_registers(inst, address, count):
+    """ Returns the raw payload of a read input registers (0x04) request: the
+    byte count followed by the big endian register data """
+    request = rtu.request_frame(inst.address, 0x04, address, count)
+    if str is not bytes:
+        request = request.decode("latin1")  # minimalmodbus speaks latin1 strings on Python 3
+    response = inst._communicate(request, rtu.response_size(count))
+    if not isinstance(response, bytes):
+        response = response.encode("latin1")
+    payload = rtu.check_response(response, inst.address, 0x04)
+    if len(payload) != 1 + 2 * count or ord(payload[0:1]) != 2 * count:
+        raise minimalmodbus.InvalidResponseError("Wrong byte count in response: %r" % response)
+    return payload
+
+def decode_ac(payload):
+    d = _AC_REGISTERS.unpack_from(payload, 1)
+    r = AcReading()
+    r.voltage    = round(d[0] * 0.1, 1)                     # Voltage(0.1V)
+    r.current    = round(((d[2] << 16) | d[1]) * 0.001, 3)  # Current(0.001A)
+    r.power      = round(((d[4] << 16) | d[3]) * 0.1, 1)    # Power(0.1W)
+    r.energy     = float((d[6] << 16) | d[5])               # Energy(1Wh)
+    r.frequency  = round(d[7] * 0.1, 1)                     # Frequency(0.1Hz)
+    r.pow_factor = round(d[8] * 0.01, 2)                    # Power Factor(0.01)
+    r.alarm_pow  = d[9] != 0
+    return r
+
+def decode_dc(payload):
+    d = _DC_REGISTERS.unpack_from(payload, 1)
+    r = DcReading()
+    r.voltage    = round(d[0] * 0.01, 2)                    # Voltage(0.01V)
+    r.current    = round(d[1] * 0.01, 2)                    # Current(0.01A)
+    r.power      = round(((d[3] << 16) | d[2]) * 0.1, 1)    # Power(0.1W)
+    r.energy     = float((d[5] << 16) | d[4])               # Energy(1Wh)
+    r.alarm_hiv  = d[6] != 0
+    r.alarm_lov  = d[7] != 0
+    return r
+
+def read_ac(inst):
+    return decode_ac(read_input_registers(inst, 0x0000, 10))
+
+def read_dc(inst):
+    return decode_dc(read_input_registers(inst, 0x0000, 8))
+
 class Instrument:
     def __init__(self, serial, address, typ):
         self.serial = serial
@@ -64,8 +133,8 @@ class Instrument:
         self.type = typ
 
     def readings(self):
-        if self.type == 'ac': return ac_readings(self.instr)
-        if self.type == 'dc': return dc_readings(self.instr)
+        if self.type == 'ac': return read_ac(self.instr)
+        if self.type == 'dc': return read_dc(self.instr)
 
     def deviceinfo(self):
         if self.type == 'ac': return ac_deviceinfo(self.instr)
@@ -0,0 +1,60 @@
+import struct
+
+import minimalmodbus
+
+# Modbus RTU framing on bytes, for the requests the poller sends over and
+# over again. Request frames are built once per (slave, function, address,
+# count) and cached, and responses are checked without the string based
+# helpers of minimalmodbus.
+
+try:
+    # C implementation of the CRC, when the crcmod extension is installed
+    import crcmod.predefined
+    _crc16 = crcmod.predefined.mkCrcFun('modbus')
+except ImportError:
+    _crc16 = None
+
+def crc16_table(data):
+    ''' CRC-16/MODBUS of a bytes-like object, using the lookup table '''
+    register = 0xFFFF
+    table = minimalmodbus._CRC16TABLE
+    for byte in bytearray(data):
+        register = (register >> 8) ^ table[(register ^ byte) & 0xFF]
+    return register
+
+crc16 = _crc16 or crc16_table
+
+_frames = {}
+
+def request_frame(slave, functioncode, address, count):
+    ''' the RTU frame of a read request, CRC included '''
+    key = (slave, functioncode, address, count)
+    frame = _frames.get(key)
+    if frame is None:
+        frame = struct.pack(">BBHH", slave, functioncode, address, count)
+        frame += struct.pack("<H", crc16(frame))
+        _frames[key] = frame
+    return frame
+
+def response_size(count):
+    ''' size of the response to a read registers request '''
+    return 5 + 2 * count
+
+def check_response(response, slave, functioncode):
+    ''' Checks the CRC, slave address and function code of a response frame
+    and returns its payload (byte count and register data) '''
+    if len(response) < 5:
+        raise minimalmodbus.InvalidResponseError("Too short Modbus RTU response: %r" % response)
+    # The CRC of a frame followed by its own CRC is zero
+    if crc16(response) != 0:
+        raise minimalmodbus.InvalidResponseError("Checksum error in rtu mode. The response is: %r" % response)
+    header = bytearray(response[0:2])
+    if header[0] != slave:
+        raise minimalmodbus.InvalidResponseError("Wrong return slave address: %d instead of %d. The response is: %r" % (
+            header[0], slave, response))
+    if header[1] == functioncode | 0x80:
+        minimalmodbus._check_response_slaveerrorcode(response.decode("latin1") if str is not bytes else response)
+    if header[1] != functioncode:
+        raise minimalmodbus.InvalidResponseError("Wrong functioncode: %d instead of %d. The response is: %r" % (
+            header[1], functioncode, response))
+    return response[2:-2]
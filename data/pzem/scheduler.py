@@ -0,0 +1,133 @@
+import gobject
+import logging
+import math
+import time
+from transport import SyncTransport
+
+# Polling of the slaves connected to a single RS-485 bus (one tty).
+#
+# Each slave gets a PollJob with its own interval and priority. The scheduler
+# runs at most one Modbus transaction per main loop wakeup, so D-Bus requests
+# are served between two transactions, and it always picks the most urgent
+# job among those that are due. Slaves that stop answering are backed off so
+# that their timeouts do not eat the bus time of the others.
+#
+# The transactions themselves are run by a transport (see transport.py); with
+# a ThreadTransport the main loop is not blocked by the serial round trip.
+
+class PollJob:
+    def __init__(self, name, read, on_result, on_error=None, interval=1.0, priority=0, max_backoff=30.0):
+        self.name = name
+        self.read = read
+        self.on_result = on_result
+        self.on_error = on_error
+        self.interval = interval
+        self.priority = priority
+        self.max_backoff = max_backoff
+
+        self.due = 0
+        self.failures = 0
+        self.polls = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.last_success = None
+        self.avg_period = None
+
+    def rate(self):
+        ''' achieved rate of successful polls, in Hz '''
+        if not self.avg_period: return 0.0
+        return 1.0 / self.avg_period
+
+    def _reschedule(self, now):
+        if self.failures:
+            delay = min(self.interval * (2 ** (self.failures - 1)), max(self.max_backoff, self.interval))
+            self.due = now + delay
+        else:
+            # Keep the cadence of the job, but do not try to catch up polls
+            # that were missed because the bus was busy
+            self.due = max(self.due + self.interval, now)
+
+    def _success(self, now):
+        self.polls += 1
+        self.failures = 0
+        if self.last_success is not None:
+            period = now - self.last_success
+            if self.avg_period is None: self.avg_period = period
+            else: self.avg_period += 0.1 * (period - self.avg_period)
+        self.last_success = now
+
+    def _failure(self):
+        self.errors += 1
+        self.failures += 1
+
+    def __repr__(self):
+        return "%s: %.2f Hz (interval %.1fs, priority %d), %d polls, %d errors, %.0f ms/poll" % (
+            self.name, self.rate(), self.interval, self.priority, self.polls, self.errors,
+            1e3 * self.busy_time / max(self.polls + self.errors, 1))
+
+class BusScheduler:
+    def __init__(self, tty, transport=None, stats_interval=300):
+        self.tty = tty
+        self.transport = transport or SyncTransport(tty)
+        self.jobs = []
+        self._current = None
+        self.stats_interval = stats_interval
+        self._timer = None
+        self._last_stats = time.time()
+
+    def add_job(self, name, read, on_result, on_error=None, interval=1.0, priority=0):
+        job = PollJob(name, read, on_result, on_error, interval=interval, priority=priority)
+        job.due = time.time()
+        self.jobs.append(job)
+        self._schedule()
+        return job
+
+    def stats(self):
+        return dict((job.name, job.rate()) for job in self.jobs)
+
+    def _next_job(self, now):
+        ready = [job for job in self.jobs if job.due <= now]
+        if not ready: return None
+        return min(ready, key=lambda job: (-job.priority, job.due))
+
+    def _schedule(self):
+        if self._timer is not None:
+            gobject.source_remove(self._timer)
+        self._timer = None
+        if not self.jobs or self._current is not None: return
+        delay = min(job.due for job in self.jobs) - time.time()
+        self._timer = gobject.timeout_add(max(int(math.ceil(delay * 1e3)), 0), self._run)
+
+    def _run(self):
+        self._timer = None
+        now = time.time()
+        if now - self._last_stats >= self.stats_interval:
+            self._last_stats = now
+            for job in self.jobs:
+                logging.info("%s %r" % (self.tty, job))
+            logging.info("%s: %d transactions queued, %d in flight" % (
+                self.tty, self.transport.queued, self.transport.in_flight))
+        job = self._next_job(now)
+        if job is not None:
+            self._current = job
+            self.transport.submit(job.read, lambda result, error, duration: self._done(job, now, result, error, duration))
+        self._schedule()
+        return False
+
+    def _done(self, job, start, result, error, duration):
+        self._current = None
+        job.busy_time += duration
+        try:
+            if error is not None:
+                job._failure()
+                job._reschedule(start)
+                if job.on_error: job.on_error(error)
+            else:
+                job._success(start)
+                job._reschedule(start)
+                job.on_result(result)
+        except Exception:
+            # a failing service must not stop the polling of the whole bus
+            logging.exception("%s: error while handling the result of %s" % (self.tty, job.name))
+        finally:
+            self._schedule()
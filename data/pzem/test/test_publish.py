@@ -0,0 +1,43 @@
+''' pytest tests of the publication filter '''
+
+import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+
+from publish import PublishFilter, PublishPolicy, AC_POLICIES
+
+class Service(dict):
+    ''' a VeDbusService keeping the values it exports in a dict '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+def update(publish, service, values):
+    with publish.batch(service) as s:
+        for path, value in values.items():
+            s[path] = value
+
+def test_deadband():
+    service = Service({'/Ac/Power': None})
+    publish = PublishFilter({'Power': PublishPolicy(deadband=1.0)})
+    update(publish, service, {'/Ac/Power': 100.0})
+    update(publish, service, {'/Ac/Power': 100.5})
+    assert service['/Ac/Power'] == 100.0
+    update(publish, service, {'/Ac/Power': 102.0})
+    assert service['/Ac/Power'] == 102.0
+    assert publish.emitted == 2
+    assert publish.suppressed == 1
+
+def test_recovery_after_error():
+    service = Service({'/Ac/Power': None, '/ErrorCode': 0, '/Connected': 0})
+    publish = PublishFilter(AC_POLICIES)
+    update(publish, service, {'/Ac/Power': 100.0, '/ErrorCode': 0, '/Connected': 1})
+    assert service == {'/Ac/Power': 100.0, '/ErrorCode': 0, '/Connected': 1}
+    # error() sets the status paths on the service, without the filter
+    with service as s:
+        s['/ErrorCode'] = 1
+        s['/Connected'] = 0
+    update(publish, service, {'/Ac/Power': 100.0, '/ErrorCode': 0, '/Connected': 1})
+    assert service == {'/Ac/Power': 100.0, '/ErrorCode': 0, '/Connected': 1}
@@ -0,0 +1,60 @@
+''' pytest tests of the decoding of PZEM readings '''
+
+import binascii
+import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+
+import minimalmodbus
+import pytest
+
+import pzem
+
+def frame(s):
+    return binascii.unhexlify(s.replace(' ', ''))
+
+# read input registers responses of a PZEM-016 at 230.5V, 100.000A, 23050.0W,
+# 1201784Wh, 49.9Hz and a power factor of 0.95, and of a PZEM-017 at 12.50V,
+# 5.00A, 62.5W and 100Wh with its high voltage alarm on
+AC_RESPONSE = frame('01 04 14 0901 86A0 0001 8464 0003 5678 0012 01F3 005F 0000 E6C9')
+DC_RESPONSE = frame('01 04 10 04E2 01F4 0271 0000 0064 0000 FFFF 0000 090A')
+
+class Instrument:
+    ''' a minimalmodbus instrument answering requests with a response frame '''
+    def __init__(self, response, address=1):
+        self.address = address
+        self.response = response
+        self.requests = []
+
+    def _communicate(self, request, size):
+        self.requests.append((request, size))
+        return self.response
+
+def test_decode_ac():
+    r = pzem.decode_ac(AC_RESPONSE[2:-2])
+    assert (r.voltage, r.current, r.power, r.energy) == (230.5, 100.0, 23050.0, 1201784.0)
+    assert (r.frequency, r.pow_factor, r.alarm_pow) == (49.9, 0.95, False)
+    assert r['power'] == r.power
+
+def test_decode_dc():
+    r = pzem.decode_dc(DC_RESPONSE[2:-2])
+    assert (r.voltage, r.current, r.power, r.energy) == (12.5, 5.0, 62.5, 100.0)
+    assert (r.alarm_hiv, r.alarm_lov) == (True, False)
+
+def test_read_ac():
+    inst = Instrument(AC_RESPONSE)
+    assert pzem.read_ac(inst).energy == 1201784.0
+    assert inst.requests == [(frame('01 04 0000 000A 700D'), len(AC_RESPONSE))]
+
+def test_read_dc():
+    inst = Instrument(DC_RESPONSE)
+    assert pzem.read_dc(inst).power == 62.5
+    assert inst.requests == [(frame('01 04 0000 0008 F1CC'), len(DC_RESPONSE))]
+
+@pytest.mark.parametrize('response', [
+    AC_RESPONSE[:-1] + b'\x00',     # bad CRC
+    DC_RESPONSE,                    # 8 registers instead of 10
+])
+def test_read_ac_invalid(response):
+    with pytest.raises(minimalmodbus.InvalidResponseError):
+        pzem.read_ac(Instrument(response))
@@ -0,0 +1,71 @@
+''' pytest tests of the Modbus RTU framing '''
+
+import binascii
+import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+
+import minimalmodbus
+import pytest
+
+import rtu
+
+def frame(s):
+    return binascii.unhexlify(s.replace(' ', ''))
+
+# read input registers request of a PZEM-016 and its response at 220.0V, 1.000A,
+# 220.0W, 0Wh, 50.0Hz and a power factor of 1.00
+AC_REQUEST = frame('01 04 0000 000A 700D')
+AC_RESPONSE = frame('01 04 14 0898 03E8 0000 0898 0000 0000 0000 01F4 0064 0000 63CE')
+
+def minimalmodbus_crc(data):
+    ''' the CRC of data computed by minimalmodbus, which works on strings '''
+    if str is not bytes:
+        data = data.decode('latin1')
+    crc = minimalmodbus._calculate_crc_string(data)
+    return ord(crc[0]) | ord(crc[1]) << 8
+
+@pytest.mark.parametrize('crc16', [rtu.crc16, rtu.crc16_table])
+def test_crc(crc16):
+    assert crc16(AC_REQUEST[:-2]) == 0x0D70
+    assert crc16(AC_REQUEST) == 0
+    assert crc16(AC_RESPONSE) == 0
+    for data in (b'', b'\x00', b'\xff' * 7, AC_RESPONSE[:-2], bytes(bytearray(range(256)))):
+        assert crc16(data) == minimalmodbus_crc(data)
+
+def test_request_frame():
+    assert rtu.request_frame(1, 0x04, 0x0000, 10) == AC_REQUEST
+    assert rtu.request_frame(1, 0x04, 0x0000, 8) == frame('01 04 0000 0008 F1CC')
+    assert rtu.request_frame(2, 0x03, 0x0001, 2)[:-2] == frame('02 03 0001 0002')
+    assert rtu.request_frame(1, 0x04, 0x0000, 10) is rtu.request_frame(1, 0x04, 0x0000, 10)
+    assert rtu.response_size(10) == len(AC_RESPONSE)
+
+def test_check_response():
+    assert rtu.check_response(AC_RESPONSE, 1, 0x04) == AC_RESPONSE[2:-2]
+
+@pytest.mark.parametrize('response', [
+    AC_RESPONSE[:-1] + b'\x00',             # bad CRC
+    AC_RESPONSE[:3] + b'\x09' + AC_RESPONSE[4:],  # corrupted register
+    AC_RESPONSE[:4],                        # too short
+])
+def test_bad_crc(response):
+    with pytest.raises(minimalmodbus.InvalidResponseError):
+        rtu.check_response(response, 1, 0x04)
+
+def test_wrong_slave_or_function():
+    with pytest.raises(minimalmodbus.InvalidResponseError):
+        rtu.check_response(AC_RESPONSE, 2, 0x04)
+    with pytest.raises(minimalmodbus.InvalidResponseError):
+        rtu.check_response(AC_RESPONSE, 1, 0x03)
+
+@pytest.mark.parametrize('code, exception', [
+    (0x02, minimalmodbus.IllegalRequestError),
+    (0x04, minimalmodbus.SlaveReportedException),
+    (0x06, minimalmodbus.SlaveDeviceBusyError),
+])
+def test_exception_response(code, exception):
+    response = frame('01 84') + bytes(bytearray([code]))
+    crc = rtu.crc16(response)
+    response += bytes(bytearray([crc & 0xFF, crc >> 8]))
+    with pytest.raises(exception):
+        rtu.check_response(response, 1, 0x04)
@@ -0,0 +1,133 @@
+''' pytest tests of the bus scheduler '''
+
+import os
+import sys
+import threading
+import time
+import types
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+try:
+    import gobject
+except ImportError:
+    # the scheduler only uses the timers of gobject, replaced by MainLoop below
+    sys.modules['gobject'] = types.ModuleType('gobject')
+
+import scheduler
+import transport
+
+class MainLoop:
+    ''' the timers of gobject and the clock of the scheduler, run by hand '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sources = {}
+        self.next_id = 1
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def timeout_add(self, ms, callback, *args):
+        with self.lock:
+            source = self.next_id
+            self.next_id += 1
+            self.sources[source] = (self.now + ms / 1e3, callback, args)
+        return source
+
+    def idle_add(self, callback, *args):
+        return self.timeout_add(0, callback, *args)
+
+    def source_remove(self, source):
+        with self.lock:
+            self.sources.pop(source, None)
+
+    def iteration(self):
+        ''' moves the clock to the next timer and runs the callbacks due, returns their number '''
+        with self.lock:
+            if not self.sources:
+                return 0
+            self.now = max(self.now, min(due for due, callback, args in self.sources.values()))
+            pending = sorted((source, item) for source, item in self.sources.items() if item[0] <= self.now)
+            for source, item in pending:
+                del self.sources[source]
+        for source, (due, callback, args) in pending:
+            callback(*args)
+        return len(pending)
+
+def setup_function(f):
+    global loop
+    loop = MainLoop()
+    scheduler.gobject = loop
+    scheduler.time = loop
+    transport.gobject = loop
+
+def failing(result):
+    raise ValueError("bad reading")
+
+def test_failing_callback_keeps_polling():
+    bus = scheduler.BusScheduler('ttyTEST', scheduler.SyncTransport('ttyTEST'))
+    job = bus.add_job('meter', lambda: 1, failing, failing, interval=0)
+    for i in range(5):
+        loop.iteration()
+    assert job.polls == 5
+
+def test_failing_error_callback_keeps_polling():
+    def read():
+        raise IOError("no answer")
+    bus = scheduler.BusScheduler('ttyTEST', scheduler.SyncTransport('ttyTEST'))
+    job = bus.add_job('meter', read, failing, failing, interval=0)
+    job.max_backoff = 0
+    for i in range(5):
+        loop.iteration()
+    assert job.errors == 5
+
+def test_failing_callback_keeps_polling_threaded():
+    io = transport.ThreadTransport('ttyTEST')
+    try:
+        bus = scheduler.BusScheduler('ttyTEST', io)
+        job = bus.add_job('meter', lambda: 1, failing, failing, interval=0)
+        deadline = time.time() + 5
+        while job.polls < 5 and time.time() < deadline:
+            if not loop.iteration():
+                time.sleep(0.001)
+        assert job.polls == 5
+    finally:
+        io.close()
+
+def recorder(name, log, failures=0):
+    ''' a read logging the time of its polls, failing the first failures times '''
+    def read():
+        log.append((name, loop.now))
+        if len(log) <= failures:
+            raise IOError("no answer")
+        return name
+    return read
+
+def run(log, n):
+    while len(log) < n and loop.iteration():
+        pass
+
+def test_interval():
+    log = []
+    bus = scheduler.BusScheduler('ttyTEST')
+    bus.add_job('meter', recorder('meter', log), lambda r: None, interval=5)
+    run(log, 4)
+    assert [t for name, t in log] == [1000.0, 1005.0, 1010.0, 1015.0]
+
+def test_priority():
+    log = []
+    bus = scheduler.BusScheduler('ttyTEST')
+    bus.add_job('low', recorder('low', log), lambda r: None, interval=2, priority=0)
+    bus.add_job('high', recorder('high', log), lambda r: None, interval=2, priority=1)
+    run(log, 6)
+    # one transaction per wakeup, the most urgent first
+    assert [name for name, t in log] == ['high', 'low'] * 3
+    assert [t for name, t in log] == [1000.0, 1000.0, 1002.0, 1002.0, 1004.0, 1004.0]
+
+def test_backoff():
+    log = []
+    bus = scheduler.BusScheduler('ttyTEST')
+    job = bus.add_job('meter', recorder('meter', log, failures=7), lambda r: None, interval=1)
+    run(log, 10)
+    # the delay doubles after each failure up to max_backoff, and is reset by a success
+    assert [t - 1000 for name, t in log] == [0, 1, 3, 7, 15, 31, 61, 91, 92, 93]
+    assert job.errors == 7 and job.failures == 0 and job.polls == 3
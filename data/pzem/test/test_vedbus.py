@@ -0,0 +1,153 @@
+''' pytest tests of the batching and indexing of the paths of VeDbusService '''
+
+import os
+import sys
+import types
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'ext', 'velib_python'))
+try:
+    import dbus
+except ImportError:
+    # the tests below do not touch the bus, vedbus and ve_utils only need the
+    # names they use when imported
+    dbus = types.ModuleType('dbus')
+    dbus.service = types.ModuleType('dbus.service')
+    dbus.service.Object = type('Object', (object,), {})
+    dbus.service.method = dbus.service.signal = lambda *args, **kwargs: (lambda f: f)
+    for name in ('Array', 'Signature', 'Byte', 'Int16', 'UInt16', 'Int32', 'UInt32', 'Int64', 'UInt64'):
+        setattr(dbus, name, type(name, (object,), {'__init__': lambda self, *args, **kwargs: None}))
+    sys.modules['dbus'] = dbus
+    sys.modules['dbus.service'] = dbus.service
+
+import vedbus
+from vedbus import PathIndexNode, VeDbusService
+
+class Item:
+    ''' a VeDbusItemExport signalling the changes of its value as its Value '''
+    def __init__(self, value):
+        self.value = value
+
+    def local_get_value(self):
+        return self.value
+
+    def GetText(self):
+        return '%sW' % self.value
+
+    def _local_set_value(self, value):
+        if value == self.value:
+            return None
+        self.value = value
+        return {'Value': value}
+
+class Root:
+    ''' the root object of a service, recording the ItemsChanged signals '''
+    def __init__(self):
+        self.signals = []
+
+    def ItemsChanged(self, changes):
+        self.signals.append(changes)
+
+class TreeExport:
+    ''' a VeDbusTreeExport, removed from the bus by __del__ '''
+    def __init__(self):
+        self.removed = False
+
+    def __del__(self):
+        self.removed = True
+
+class Service(VeDbusService):
+    ''' a VeDbusService exporting Items without a bus '''
+    def __init__(self, values):
+        self._ratelimiters = []
+        self._dbusobjects = {}
+        self._dbusnodes = {'/': Root()}
+        self._index = PathIndexNode()
+        for path, value in sorted(values.items()):
+            spl = path.split('/')
+            for i in range(2, len(spl)):
+                self._dbusnodes.setdefault('/'.join(spl[:i]), TreeExport())
+            self._dbusobjects[path] = Item(value)
+            self._index.add(path, self._dbusobjects[path])
+
+    @property
+    def signals(self):
+        return self._dbusnodes['/'].signals
+
+def test_context():
+    service = Service({'/Ac/Power': 0, '/Ac/Voltage': 230, '/Connected': 1})
+    with service as s:
+        s['/Ac/Power'] = 100
+        s['/Ac/Power'] = 150
+        s['/Ac/Voltage'] = 230
+        s['/Connected'] = 1
+        assert service.signals == []
+        assert s['/Ac/Power'] == 150
+    assert service.signals == [{'/Ac/Power': {'Value': 150}}]
+
+def test_unchanged():
+    service = Service({'/Ac/Power': 0})
+    service.update_many({'/Ac/Power': 0})
+    assert service.signals == []
+    assert service._ratelimiters == []
+
+def test_nested_contexts():
+    service = Service({'/Ac/Power': 0, '/Ac/Voltage': 230, '/Ac/Current': 0})
+    with service as s:
+        s['/Ac/Power'] = 100
+        with service as inner:
+            inner['/Ac/Voltage'] = 231
+            inner['/Ac/Power'] = 200
+        service['/Ac/Current'] = 1
+        service.update_many({'/Ac/Current': 2})
+        assert service.signals == []
+    assert service.signals == [{
+        '/Ac/Power': {'Value': 200},
+        '/Ac/Voltage': {'Value': 231},
+        '/Ac/Current': {'Value': 2},
+    }]
+
+def test_index():
+    service = Service({'/Ac/L1/Power': 1, '/Ac/L1/Voltage': 2, '/Ac/Power': 3, '/Connected': 4})
+    index = service._index
+    assert index.find('/Ac/L1/Power').item is service._dbusobjects['/Ac/L1/Power']
+    assert index.find('/Ac/L1').item is None
+    assert index.find('/Ac/L2') is None
+    assert index.find('/Ac/L1/Power/Max') is None
+    assert index.find('/') is index
+    assert sorted(p for p, item in index.find('/Ac').walk('')) == ['L1/Power', 'L1/Voltage', 'Power']
+    assert sorted(p for p, item in index.walk('/')) == ['/Ac/L1/Power', '/Ac/L1/Voltage', '/Ac/Power', '/Connected']
+
+def test_delete():
+    service = Service({'/Ac/L1/Power': 1, '/Ac/L1/Voltage': 2, '/Ac/Power': 3, '/Connected': 4})
+    l1 = service._dbusnodes['/Ac/L1']
+    service._item_deleted('/Ac/L1/Power')
+    assert service._index.find('/Ac/L1/Power') is None
+    assert service._index.find('/Ac/L1') is not None
+    service._item_deleted('/Ac/L1/Voltage')
+    # /Ac/L1 is left without items, /Ac still holds /Ac/Power
+    assert service._index.find('/Ac/L1') is None
+    assert l1.removed and '/Ac/L1' not in service._dbusnodes
+    assert '/Ac' in service._dbusnodes
+    service._item_deleted('/Ac/Power')
+    assert sorted(service._index.children) == ['Connected']
+    assert sorted(service._dbusnodes) == ['/']
+    assert sorted(service._dbusobjects) == ['/Connected']
+
+def test_tree_values(monkeypatch):
+    monkeypatch.setattr(vedbus, 'wrap_dbus_value', lambda value: value)
+    service = Service({'/Ac/L1/Power': 1, '/Ac/Power': 3, '/Connected': 4})
+    assert service._get_tree_dict('/Ac') == {'L1/Power': 1, 'Power': 3}
+    assert service._get_tree_dict('/Dc') == {}
+    cached = service._get_tree_dict('/')
+    assert service._get_tree_dict('/') is cached
+    service._dbusobjects['/Ac/L1/Power'].value = 2
+    service._item_changed('/Ac/L1/Power')
+    assert service._get_tree_dict('/') == {'Ac/L1/Power': 2, 'Ac/Power': 3, 'Connected': 4}
+    assert service._get_tree_dict('/Ac/L1') == {'Power': 2}
+
+def test_items(monkeypatch):
+    monkeypatch.setattr(vedbus, 'wrap_dbus_value', lambda value: value)
+    service = Service({'/Ac/Power': 3, '/Ac/L1/Power': 1})
+    assert service._get_items() == {
+        '/Ac/Power': {'Value': 3, 'Text': '3W'},
+        '/Ac/L1/Power': {'Value': 1, 'Text': '1W'},
+    }
@@ -0,0 +1,85 @@
+import gobject
+import logging
+import threading
+import time
+import Queue
+
+# Transports run the Modbus transactions of a bus and report their outcome
+# with on_done(result, error, duration) in the GLib main loop.
+#
+# SyncTransport performs the transaction immediately, blocking the main loop
+# for the serial round trip. ThreadTransport hands the transactions to a
+# dedicated I/O thread and reports back through idle_add, so D-Bus requests
+# are never queued behind serial latency.
+
+class SyncTransport:
+    def __init__(self, tty):
+        self.tty = tty
+        self.in_flight = 0
+
+    @property
+    def queued(self):
+        return 0
+
+    def submit(self, transaction, on_done):
+        self.in_flight += 1
+        start = time.time()
+        try:
+            result = transaction()
+        except Exception as e:
+            self.in_flight -= 1
+            on_done(None, e, time.time() - start)
+        else:
+            self.in_flight -= 1
+            on_done(result, None, time.time() - start)
+
+    def close(self):
+        pass
+
+class ThreadTransport:
+    def __init__(self, tty):
+        self.tty = tty
+        self._pending = 0
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._work, name="modbus-%s" % tty)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def queued(self):
+        ''' number of transactions waiting for the I/O thread '''
+        return self._queue.qsize()
+
+    @property
+    def in_flight(self):
+        ''' number of transactions being performed or whose result is not handled yet '''
+        return max(self._pending - self._queue.qsize(), 0)
+
+    def submit(self, transaction, on_done):
+        self._pending += 1
+        self._queue.put((transaction, on_done))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None: return
+            transaction, on_done = item
+            start = time.time()
+            try:
+                result = transaction()
+            except Exception as e:
+                gobject.idle_add(self._done, on_done, None, e, time.time() - start)
+            else:
+                gobject.idle_add(self._done, on_done, result, None, time.time() - start)
+
+    def _done(self, on_done, result, error, duration):
+        self._pending -= 1
+        try:
+            on_done(result, error, duration)
+        except Exception:
+            logging.exception("%s: error while handling Modbus transaction result" % self.tty)
+        return False
@@ -0,0 +1,73 @@
+#  license: GNU LGPL
+#
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+# pylint: disable-msg=C0301
+# C0301: Line too long (104/80) - maybe trim docstrings later for terminal users
+
+'''
+Benchmarks of the bulk methods of TeaFile against their item by item counterparts, and of reopening files
+with the header cache. Run this module to print the timings, the number of items can be passed on the command
+line:
+
+    python benchmarks.py 525600
+'''
+
+import os
+import sys
+import tempfile
+from stopwatch import Stopwatch
+from teafiles import *
+from teafiles import teafile
+
+
+def createminutes(filename, n):
+    '''
+    Create a TeaFile holding `n` items of per-minute "Energy" samples, like the files written by tealogger.
+    '''
+    with TeaFile.create(filename, "DischargedEnergy ChargedEnergy", "ff") as tf:
+        for i in range(n):
+            tf.write(i * 0.01, i * 0.02)
+
+
+def benchmark_columns(filename):
+    ''' sums a column, reading all items with items() then with columns() '''
+    with TeaFile.openread(filename) as tf:
+        print("{} items, numpy {}".format(tf.itemcount, "enabled" if teafile.numpy else "not available"))
+        print("items():")
+        with Stopwatch():
+            total = sum(item.ChargedEnergy for item in tf.items())
+        print("columns():")
+        with Stopwatch():
+            columntotal = sum(tf.columns().ChargedEnergy)
+        assert abs(total - columntotal) <= 1e-6 * abs(total)
+
+
+def benchmark_open(filename, n=1000):
+    ''' opens the file `n` times, parsing its header each time then reusing the cached header '''
+    print("openread() x {}, header parsed:".format(n))
+    with Stopwatch():
+        for _ in range(n):
+            teafile._headercache.clear()
+            TeaFile.openread(filename).close()
+    print("openread() x {}, header cached:".format(n))
+    with Stopwatch():
+        for _ in range(n):
+            TeaFile.openread(filename).close()
+
+
+def main(n):
+    filename = tempfile.mktemp(".tea")
+    try:
+        createminutes(filename, n)
+        benchmark_columns(filename)
+        benchmark_open(filename)
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 60 * 24 * 365)
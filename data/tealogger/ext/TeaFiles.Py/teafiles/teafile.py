@@ -22,15 +22,26 @@
 # W0122:730,8:TeaFile._attachwritemethod: Use of the exec statement
 # C0301:172,0: Line too long (104/80) - maybe trim docstrings later for terminal users
 
+import bisect
+import os
 import struct
 import uuid
 from io import BytesIO
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from teafiles.clockwise import DateTime
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # if set to true, time fields are returned as instances of clockwise.DateTime, otherwise
 USE_TIME_DECORATION = True
 
+# the number of file headers kept by openread and openwrite, so that reopening a file skips parsing its header,
+# set to 0 to disable the cache
+HEADER_CACHE_SIZE = 256
+
 
 class TeaFile:
     '''
@@ -84,6 +95,8 @@ class TeaFile:
 
         self.itemareastart = None
         self._itemareaend = None
+        self._writeend = None       # end of the items written, tracked by writers to avoid stat calls
+        self._gaps = None           # the _GapIndex of the file, if items were skipped with writegap
         self.itemsize = None
 
         self.itemstruct = None
@@ -133,6 +146,7 @@ class TeaFile:
         tf._description = d = TeaFileDescription()
         id_ = ItemDescription.create(None, fieldnames, fieldformat)
         tf.itemstruct = id_.itemstruct
+        tf.nameditemtuple = id_.itemtype
         d.itemdescription = id_
         d.contentdescription = contentdescription
         d.namevalues = namevalues
@@ -140,13 +154,16 @@ class TeaFile:
 
         # open file and write header
 
-        tf.file = open(filename, "wb")
+        _GapIndex.remove(filename)
+        _headercache.discard(filename)
+        tf.file = open(filename, "w+b")     # readable too, columns and seektime map the file
         hm = _HeaderManager()
         fio = _FileIO(tf.file)
         fw = _FormattedWriter(fio)
         wc = hm.writeheader(fw, tf._description)
         tf.itemareastart = wc.itemareastart
         tf._itemareaend = wc.itemareaend
+        tf._writeend = wc.itemareastart
         tf.itemsize = id_.itemsize
 
         tf._attachwritemethod()     # pylint:disable-msg=W0212
@@ -185,7 +202,8 @@ class TeaFile:
         Open a TeaFile for read and write.
 
         The file returned will have its *filepointer set to the end of the file*, as this function
-        calls seekend() before returning the TeaFile instance.
+        calls seekend() before returning the TeaFile instance. A partial item at the end of the file, left by
+        a write interrupted by a crash or a power loss, is removed first.
 
         >>> with TeaFile.create('lab.tea', 'A B') as tf:
         ...     for i in range(3):
@@ -203,7 +221,9 @@ class TeaFile:
         '''
         tf = TeaFile._open(filename, "r+b")
         tf._attachwritemethod()     # pylint: disable-msg=W0212
+        tf._truncatepartialitem()   # pylint: disable-msg=W0212
         tf.seekend()                # this is what one would expect: writes append to the file
+        tf._writeend = tf.file.tell()
         return tf
 
     @staticmethod
@@ -211,18 +231,25 @@ class TeaFile:
         ''' internal open method, used by openread and openwrite '''
         tf = TeaFile(filename)
         tf.file = open(filename, mode)
-        fio = _FileIO(tf.file)
-        fr = _FormattedReader(fio)
-        hm = _HeaderManager()
-        rc = hm.readheader(fr)
-        tf._description = rc.description
+        header = _headercache.get(filename, tf.file)
+        if header:
+            tf._description, tf.itemareastart, tf._itemareaend = header
+            tf.file.seek(tf.itemareastart)
+        else:
+            fio = _FileIO(tf.file)
+            fr = _FormattedReader(fio)
+            hm = _HeaderManager()
+            rc = hm.readheader(fr)
+            tf._description = rc.description
+            tf.itemareastart = rc.itemareastart
+            tf._itemareaend = rc.itemareaend
+            _headercache.put(filename, tf.file, (rc.description, rc.itemareastart, rc.itemareaend))
         id_ = tf._description.itemdescription
         if id_:
             tf.itemsize = id_.itemsize
             tf.itemstruct = id_.itemstruct
             tf.nameditemtuple = id_.itemtype
-        tf.itemareastart = rc.itemareastart
-        tf._itemareaend = rc.itemareaend
+        tf._gaps = _GapIndex.load(filename)
 
         nvs = tf._description.namevalues
         if nvs and nvs.get("decimals"):
@@ -250,6 +277,11 @@ class TeaFile:
         >>> tf.read()
         >>>
         '''
+        if self._gaps:
+            itemindex = (self.file.tell() - self.itemareastart) // self.itemsize
+            if self._gaps.contains(itemindex):
+                self.file.seek(self.itemsize, 1)
+                return self._emptyitem()
         itembytes = self.file.read(self.itemsize)
         if not itembytes:
             return None
@@ -276,33 +308,131 @@ class TeaFile:
         if USE_TIME_DECORATION:
             itemvalues = tuple([f.decoratetime(itemvalues) for f in self.description.itemdescription.fields])
         bytes_ = self.itemstruct.pack(*itemvalues)
+        if self._gaps:
+            self._fillgaps(1)
         self.file.write(bytes_)
+        self._updatewriteend()
+
+    def write_many(self, items):
+        '''
+        Writes a sequence of items, each given as a tuple holding a value for each field.
+
+        The items are packed into a single buffer which is written to the file at once, so writing
+        many items costs a single write call instead of one per item.
+
+        >>> with TeaFile.create('lab.tea', 'A B') as tf:
+        ...     tf.write_many([(i, 10*i) for i in range(3)])
+        ...     tf.write_many([(7, 77)] * 2)
+        ...
+        >>> TeaFile.printitems("lab.tea")
+        [AB(A=0, B=0), AB(A=1, B=10), AB(A=2, B=20), AB(A=7, B=77), AB(A=7, B=77)]
+        '''
+        if not isinstance(items, (list, tuple)):
+            items = list(items)
+        fields = self.description.itemdescription.fields
+        pack_into = self.itemstruct.pack_into
+        buffer_ = bytearray(len(items) * self.itemsize)
+        offset = 0
+        for itemvalues in items:
+            if USE_TIME_DECORATION:
+                itemvalues = [f.decoratetime(itemvalues) for f in fields]
+            pack_into(buffer_, offset, *itemvalues)
+            offset += self.itemsize
+        if self._gaps:
+            self._fillgaps(len(items))
+        self.file.write(buffer_)
+        self._updatewriteend()
+
+    def _fillgaps(self, count):
+        ''' removes from the gaps the `count` items about to be written at the file pointer '''
+        start = (self.file.tell() - self.itemareastart) // self.itemsize
+        self._gaps.discard(start, start + count)
+
+    def writegap(self, count):
+        '''
+        Appends `count` empty items without writing them.
+
+        The file is extended without writing the items, leaving a hole on file systems supporting sparse
+        files, and the range of items is recorded in a gap index stored next to the file (the filename
+        followed by ".gaps"). Reading the skipped items returns empty items: float fields hold NaN,
+        other fields 0. The cost of a gap does not depend on its length.
+
+        >>> with TeaFile.create('lab.tea', 'A B', 'qd') as tf:
+        ...     tf.write(1, 1.5)
+        ...     tf.writegap(2)
+        ...     tf.write(4, 4.5)
+        ...
+        >>> TeaFile.printitems("lab.tea")
+        [AB(A=1, B=1.5), AB(A=0, B=nan), AB(A=0, B=nan), AB(A=4, B=4.5)]
+        '''
+        if count <= 0:
+            return
+        start = self.itemcount
+        end = self._writeend + count * self.itemsize
+        self.file.truncate(end)
+        self.file.seek(end)
+        self._writeend = end
+        if self._gaps is None:
+            self._gaps = _GapIndex(self._filename)
+        self._gaps.add(start, start + count)
+
+    def _emptyitem(self):
+        ''' the item returned for skipped items '''
+        fields = self._description.itemdescription.fields
+        itemvalues = [_emptyvalue(f) for f in fields]
+        return self._description.itemdescription.itemtype(*[f.getvalue(itemvalues) for f in fields])
+
+    def _updatewriteend(self):
+        ''' moves the end of the written items past the file pointer '''
+        position = self.file.tell()
+        if position > self._writeend:
+            self._writeend = position
 
     def flush(self):
         '''
         Flush buffered bytes to disk.
 
         When items are written via write, they do not land directly in the file, but are buffered in memory. flush
-        persists them on disk. Since the number of items in a TeaFile is computed from the size of the file, the
-        `itemcount` property is accuraty only after items have been flushed.
+        persists them on disk. Files opened for writing keep track of the items written, so their `itemcount`
+        includes the items not flushed yet. Files opened for reading compute the number of items from the size of
+        the file, so they see the items added by a writer only after it flushed them.
 
         >>> with TeaFile.create('lab.tea', 'A') as tf:
         ...     for i in range(3):
         ...         tf.write(i)
         ...
         >>> tf = TeaFile.openwrite('lab.tea')
-        >>> tf.itemcount
-        3L
         >>> tf.write(71)
         >>> tf.itemcount
+        4L
+        >>> reader = TeaFile.openread('lab.tea')
+        >>> reader.itemcount
         3L
         >>> tf.flush()
-        >>> tf.itemcount
+        >>> reader.itemcount
         4L
+        >>> reader.close()
         >>> tf.close()
         '''
         self.file.flush()
 
+    def fsync(self):
+        '''
+        Flush buffered bytes and wait until the operating system wrote them to the storage device. This is
+        way slower than `flush`, writers usually call it once for many items.
+        '''
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _truncatepartialitem(self):
+        ''' removes the bytes past the last complete item '''
+        if self._itemareaend:
+            return      # preallocated item area
+        size = os.fstat(self.file.fileno()).st_size
+        partial = (size - self.itemareastart) % self.itemsize
+        if partial:
+            self.file.truncate(size - partial)
+
     def seekitem(self, itemindex):
         '''
         Sets the file pointer to the item at index `temindex`.
@@ -346,6 +476,108 @@ class TeaFile:
         '''
         self.file.seek(0, 2)    # SEEK_END
 
+    def seektime(self, time):
+        '''
+        Sets the file pointer to the first item whose event time is at or after `time` and returns its index.
+        `time` is a DateTime or a number of ticks. Items must be sorted by time: the event time field of the
+        memory mapped item area is binary searched, so only a few items are read whatever the file size.
+
+        >>> with TeaFile.create('lab.tea', 'Time Price', 'qd') as tf:
+        ...     for day in range(1, 11):
+        ...         tf.write(DateTime(2011, 3, day), 40.0 + day)
+        ...
+        >>> tf = TeaFile.openread('lab.tea')
+        >>> tf.seektime(DateTime(2011, 3, 4))
+        3
+        >>> tf.read()
+        TP(Time=2011-03-04 00:00:00:000, Price=44.0)
+        >>> tf.seektime(DateTime(2012, 1, 1))
+        10
+        >>> tf.close()
+        '''
+        itemindex = self._findtime(time)
+        self.seekitem(itemindex)
+        return itemindex
+
+    def items_between(self, start, end):
+        '''
+        Returns an iterator over the items whose event time is in [start, end), located with `seektime`.
+        Calling this method will modify the filepointer.
+
+        >>> with TeaFile.create('lab.tea', 'Time Price', 'qd') as tf:
+        ...     for day in range(1, 11):
+        ...         tf.write(DateTime(2011, 3, day), 40.0 + day)
+        ...
+        >>> tf = TeaFile.openread('lab.tea')
+        >>> [item.Price for item in tf.items_between(DateTime(2011, 3, 3), DateTime(2011, 3, 6))]
+        [43.0, 44.0, 45.0]
+        >>> tf.close()
+        '''
+        first = self._findtime(start)
+        last = self._findtime(end)
+        if last <= first:
+            return iter([])
+        return self.items(first, last)
+
+    def _findtime(self, time):
+        ''' the index of the first item whose event time is at or after `time` '''
+        field = self._geteventtimefield()
+        ticks = time.ticks if isinstance(time, DateTime) else time
+        formatchar = FieldType.getformatcharacter(field.fieldtype)
+        self.file.flush()
+        lo, hi = 0, self.itemcount
+        if hi == 0:
+            return 0
+        import mmap
+        mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            while lo < hi:
+                mid = (lo + hi) // 2
+                # skipped items have no time, they are compared as the first item after their gap
+                probe = self._gaps.skip(mid) if self._gaps else mid
+                if probe >= hi:
+                    hi = mid
+                    continue
+                value = struct.unpack_from(formatchar, mm, self.itemareastart + probe * self.itemsize + field.offset)[0]
+                if value < ticks:
+                    lo = probe + 1
+                else:
+                    hi = mid
+        finally:
+            mm.close()
+        return self._gaps.skip(lo) if self._gaps else lo
+
+    def _geteventtimefield(self):
+        ''' the event time field, the first time field or, in files being created, the field named "time" '''
+        fields = self._description.itemdescription.fields
+        for f in fields:
+            if f.iseventtime:
+                return f
+        for f in fields:
+            if f.name.lower() == "time":
+                return f
+        raise ValueError("{} has no time field".format(self._filename))
+
+    def truncate(self, itemcount):
+        '''
+        Removes the items past the first `itemcount` items and sets the file pointer past the last item.
+        The file must be open for writing.
+
+        >>> with TeaFile.create('lab.tea', 'A') as tf:
+        ...     for i in range(10):
+        ...         tf.write(i)
+        ...     tf.truncate(3)
+        ...     tf.write(7)
+        ...
+        >>> TeaFile.printitems("lab.tea")
+        [A(A=0), A(A=1), A(A=2), A(A=7)]
+        '''
+        self.seekitem(itemcount)
+        self.file.truncate()
+        self._writeend = self.file.tell()
+        if self._gaps:
+            self._gaps.truncate(itemcount)
+
     def items(self, start=0, end=None):
         '''
         Returns an iterator over the items in the file allowing start and end to be passed as item index.
@@ -376,6 +608,60 @@ class TeaFile:
             yield self.read()
             current += 1
 
+    def columns(self, start=0, end=None):
+        '''
+        Returns the items in the range [start, end) as columns: a named tuple holding one array per field.
+
+        The file is memory mapped and each column is extracted with a few bulk copies, without creating
+        a Python object per item, which makes this method way faster than `items` for large ranges.
+        Columns are numpy arrays if numpy is available, otherwise `array.array` instances (or lists for
+        64 bit integers if the platform has no matching array type). Time fields hold their raw ticks.
+
+        >>> with TeaFile.create('lab.tea', 'A B', 'qd') as tf:
+        ...     for i in range(10):
+        ...         tf.write(i, i / 2.0)
+        ...
+        >>> tf = TeaFile.openread('lab.tea')
+        >>> c = tf.columns(2, 5)
+        >>> list(c.A), list(c.B)
+        ([2, 3, 4], [1.0, 1.5, 2.0])
+        >>> len(tf.columns().B)
+        10
+        >>> tf.close()
+        '''
+        self.file.flush()
+        itemcount = self.itemcount
+        if end is None or end > itemcount:
+            end = itemcount
+        start = max(0, min(start, end))
+        n = end - start
+        id_ = self._description.itemdescription
+        begin = self.itemareastart + start * self.itemsize
+        import mmap
+        mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if numpy:
+            dtype = numpy.dtype({
+                'names': id_.fieldnames,
+                'formats': [FieldType.getformatcharacter(f.fieldtype) for f in id_.fields],
+                'offsets': [f.offset for f in id_.fields],
+                'itemsize': self.itemsize})
+            items = numpy.frombuffer(mm, dtype, n, begin)
+            gaps = self._gaps.overlapping(start, end) if self._gaps else []
+            if gaps:
+                items = items.copy()
+            columns = [items[name] for name in id_.fieldnames]
+        else:
+            try:
+                raw = mm[begin:begin + n * self.itemsize]
+            finally:
+                mm.close()
+            columns = [_extractcolumn(raw, f, self.itemsize, n) for f in id_.fields]
+            gaps = self._gaps.overlapping(start, end) if self._gaps else []
+        for gapstart, gapend in gaps:
+            for f, column in zip(id_.fields, columns):
+                _fillcolumn(column, gapstart - start, gapend - start, _emptyvalue(f))
+        return id_.itemtype(*columns)
+
     @property
     def itemcount(self):
         ''' The number of items in the file. '''
@@ -383,9 +669,10 @@ class TeaFile:
 
     def _getitemareaend(self):
         ''' the end of the item area, as an integer '''
-        import os
         if self._itemareaend:
             return self._itemareaend
+        if self._writeend is not None:
+            return self._writeend
         return os.path.getsize(self._filename)
 
     def _getitemareasize(self):
@@ -480,13 +767,14 @@ class TeaFile:
     def _attachwritemethod(self):
         ''' generate specific write method with named arguments '''
         id_ = self._description.itemdescription
-        commafields = ",".join(id_.fieldnames)
-        methodcode = "def customWrite(self, " + commafields + "): self._write(" + commafields + ")"
+        if not id_.writefunction:   # generated once per item description, shared by cached headers
+            commafields = ",".join(id_.fieldnames)
+            methodcode = "def customWrite(self, " + commafields + "): self._write(" + commafields + ")"
+            d = {}
+            exec(methodcode, d)
+            id_.writefunction = d["customWrite"]
         import types
-        d = {}
-        exec(methodcode, d)
-        func = d["customWrite"]
-        boundmethod = types.MethodType(func, self)
+        boundmethod = types.MethodType(id_.writefunction, self)
         self.write = boundmethod
 
     @staticmethod
@@ -558,6 +846,171 @@ class TeaFile:
                 print(item)
 
 
+def _extractcolumn(raw, field, itemsize, n):
+    ''' extracts the values of `field` from `n` items packed in `raw` into an array. '''
+    import array
+    size = FieldType.getsize(field.fieldtype)
+    formatchar = FieldType.getformatcharacter(field.fieldtype)
+    column = bytearray(n * size)
+    for i in range(size):   # gather the i-th byte of the field in every item
+        column[i::size] = raw[field.offset + i::itemsize]
+    for typecode in (formatchar, 'l' if formatchar == 'q' else 'L'):
+        try:
+            values = array.array(typecode)
+        except ValueError:
+            continue    # no 'q' and 'Q' arrays before python 3.3
+        if values.itemsize == size:
+            values.fromstring(bytes(column))
+            return values
+    return list(struct.unpack("{}{}".format(n, formatchar), bytes(column)))
+
+
+def _emptyvalue(field):
+    ''' the value of `field` in skipped items '''
+    if field.fieldtype in (FieldType.Float, FieldType.Double):
+        return float('nan')
+    return 0
+
+
+def _fillcolumn(column, start, end, value):
+    ''' sets the values of `column` in [start, end) to `value` '''
+    if numpy and isinstance(column, numpy.ndarray):
+        column[start:end] = value
+    elif isinstance(column, list):
+        column[start:end] = [value] * (end - start)
+    else:
+        import array
+        column[start:end] = array.array(column.typecode, [value]) * (end - start)
+
+
+class _GapIndex:
+    '''
+    The ranges of items skipped with `TeaFile.writegap`. They are stored as a TeaFile of Start/End item indexes
+    next to the file they describe.
+    '''
+    def __init__(self, filename):
+        self.filename = filename + ".gaps"
+        self.gaps = []  # sorted list of [start, end) item ranges
+
+    @staticmethod
+    def load(filename):
+        ''' returns the gap index of `filename`, or None if the file has no gaps '''
+        gapindex = _GapIndex(filename)
+        if not os.path.exists(gapindex.filename):
+            return None
+        with TeaFile.openread(gapindex.filename) as tf:
+            gapindex.gaps = [(gap.Start, gap.End) for gap in tf.items()]
+        return gapindex
+
+    @staticmethod
+    def remove(filename):
+        ''' removes the gap index of `filename` if any '''
+        gapindex = _GapIndex(filename)
+        if os.path.exists(gapindex.filename):
+            os.remove(gapindex.filename)
+
+    def __len__(self):
+        return len(self.gaps)
+
+    def contains(self, itemindex):
+        ''' whether the item at `itemindex` is inside a gap '''
+        i = bisect.bisect_right(self.gaps, (itemindex, float('inf'))) - 1
+        return i >= 0 and self.gaps[i][0] <= itemindex < self.gaps[i][1]
+
+    def skip(self, itemindex):
+        ''' the index of the first item at or after `itemindex` that is not inside a gap '''
+        i = bisect.bisect_right(self.gaps, (itemindex, float('inf'))) - 1
+        if i >= 0 and self.gaps[i][0] <= itemindex < self.gaps[i][1]:
+            return self.gaps[i][1]
+        return itemindex
+
+    def overlapping(self, start, end):
+        ''' the gaps overlapping the item range [start, end), clipped to that range '''
+        return [(max(s, start), min(e, end)) for s, e in self.gaps if s < end and e > start]
+
+    def add(self, start, end):
+        ''' adds a gap past the previous ones and saves the index '''
+        if self.gaps and self.gaps[-1][1] == start:
+            self.gaps[-1] = (self.gaps[-1][0], end)
+        else:
+            self.gaps.append((start, end))
+        self.save()
+
+    def discard(self, start, end):
+        ''' removes the item range [start, end) from the gaps, as items are written there, and saves the index '''
+        gaps = []
+        for s, e in self.gaps:
+            if s < end and e > start:
+                if s < start:
+                    gaps.append((s, start))
+                if e > end:
+                    gaps.append((end, e))
+            else:
+                gaps.append((s, e))
+        if gaps != self.gaps:
+            self.gaps = gaps
+            self.save()
+
+    def truncate(self, itemcount):
+        ''' removes the gaps past `itemcount` items '''
+        self.gaps = [(s, min(e, itemcount)) for s, e in self.gaps if s < itemcount]
+        self.save()
+
+    def save(self):
+        '''
+        writes the index to a temporary file, then moves it over the previous one. Both the file and the rename are
+        synced, so that a crash leaves either the previous or the new index.
+        '''
+        temporary = self.filename + ".tmp"
+        with TeaFile.create(temporary, "Start End", "qq") as tf:
+            tf.write_many(self.gaps)
+            tf.fsync()
+        os.rename(temporary, self.filename)
+        fd = os.open(os.path.dirname(self.filename) or ".", os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class _HeaderCache:
+    '''
+    The headers read by `TeaFile._open`: the description, item area start and item area end of a file, keyed by
+    its path. An entry is used only while the modification time and size of the file are those it was read with.
+    '''
+    def __init__(self):
+        self.entries = OrderedDict()    # path -> (mtime, size, header), least recently used first
+
+    @staticmethod
+    def _stat(file_):
+        st = os.fstat(file_.fileno())
+        return st.st_mtime, st.st_size
+
+    def get(self, filename, file_):
+        ''' the header of `filename` opened as `file_` if cached, otherwise None '''
+        path = os.path.abspath(filename)
+        entry = self.entries.pop(path, None)
+        if entry is None or entry[:2] != self._stat(file_):
+            return None
+        self.entries[path] = entry
+        return entry[2]
+
+    def put(self, filename, file_, header):
+        if HEADER_CACHE_SIZE <= 0:
+            return
+        self.entries[os.path.abspath(filename)] = self._stat(file_) + (header,)
+        while len(self.entries) > HEADER_CACHE_SIZE:
+            self.entries.popitem(last=False)
+
+    def discard(self, filename):
+        self.entries.pop(os.path.abspath(filename), None)
+
+    def clear(self):
+        self.entries.clear()
+
+_headercache = _HeaderCache()
+
+
 class _ValueKind:   # pylint: disable-msg=R0903
     ''' enumeration type, describing the type of a value inside a name-value pair '''
     Invalid, Int32, Double, Text, Uuid = [0, 1, 2, 3, 4]
@@ -841,6 +1294,7 @@ class ItemDescription:
         self.itemstruct = None  # the struct for marshalling to the file
         self.itemtype = None    # the named tuple class used for items
         self.fieldnames = None
+        self.writefunction = None   # the generated write method, see TeaFile._attachwritemethod
 
     def __repr__(self):
         from pprint import pformat
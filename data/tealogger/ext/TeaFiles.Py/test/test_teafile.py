@@ -16,6 +16,7 @@
 ''' pytest tests '''
 
 import tempfile
+import math
 import os
 import sys
 from teafiles import *
@@ -199,6 +200,199 @@ def test_items_iteration():
         assert len([item for item in tf.items()]) == 2
 
 
+def test_write_many():
+    filename = gettempfilename()
+    with TeaFile.create(filename, "Time A B", "qqd") as tf:
+        tf.write(DateTime(2011, 3, 1), 1, 1.5)
+        tf.write_many([(DateTime(2011, 3, 2), 2, 2.5), (DateTime(2011, 3, 3), 3, 3.5)])
+        tf.write_many(iter([(4, 4, 4.5)]))
+        tf.write_many([])
+    with TeaFile.openread(filename) as tf:
+        assert tf.itemcount == 4
+        items = list(tf.items())
+        assert items[1].Time == DateTime(2011, 3, 2)
+        assert [item.A for item in items] == [1, 2, 3, 4]
+        assert [item.B for item in items] == [1.5, 2.5, 3.5, 4.5]
+
+
+def test_itemcount_without_stat(monkeypatch):
+    statcalls = []
+    getsize = os.path.getsize
+    def countinggetsize(filename):
+        statcalls.append(filename)
+        return getsize(filename)
+    monkeypatch.setattr(os.path, "getsize", countinggetsize)
+
+    filename = gettempfilename()
+    with TeaFile.create(filename, "A B", "qq") as tf:
+        while tf.itemcount < 100:
+            tf.write(tf.itemcount, 0)
+    with TeaFile.openwrite(filename) as tf:
+        assert tf.itemcount == 100
+        while tf.itemcount < 200:
+            tf.write(tf.itemcount, 0)
+        tf.truncate(150)
+        assert tf.itemcount == 150
+        tf.seekitem(10)
+        tf.write(10, 1)
+        assert tf.itemcount == 150
+    assert statcalls == []
+
+    # readers follow the size of the file
+    with TeaFile.openread(filename) as tf:
+        assert tf.itemcount == 150
+        assert tf.itemcount == 150
+    assert len(statcalls) == 2
+
+
+def test_openwrite_truncates_partial_item():
+    filename = gettempfilename()
+    with TeaFile.create(filename, "A B", "qd") as tf:
+        for i in range(3):
+            tf.write(i, i * 1.5)
+    with open(filename, "ab") as f:     # interrupted write of a fourth item
+        f.write(b"\x04\x00\x00")
+    with TeaFile.openwrite(filename) as tf:
+        assert tf.itemcount == 3
+        tf.write(3, 4.5)
+        tf.fsync()
+    with TeaFile.openread(filename) as tf:
+        assert list(tf.items()) == [(0, 0.0), (1, 1.5), (2, 3.0), (3, 4.5)]
+
+
+def test_writegap():
+    filename = gettempfilename()
+    with TeaFile.create(filename, "A B", "qd") as tf:
+        tf.write(1, 1.5)
+        tf.writegap(100000)
+        tf.write(2, 2.5)
+        tf.writegap(2)
+        tf.writegap(3)
+        assert tf.itemcount == 100007
+    with TeaFile.openwrite(filename) as tf:
+        tf.write(3, 3.5)
+    with TeaFile.openread(filename) as tf:
+        assert tf.itemcount == 100008
+        items = list(tf.items(100000, 100008))
+        assert [item.A for item in items] == [0, 2, 0, 0, 0, 0, 0, 3]
+        assert math.isnan(items[0].B) and items[1].B == 2.5
+        c = tf.columns(99999)
+        assert list(c.A) == [0, 0, 2, 0, 0, 0, 0, 0, 3]
+        assert [math.isnan(b) for b in c.B] == [True, True, False, True, True, True, True, True, False]
+    with TeaFile.create(filename, "A B", "qd") as tf:    # recreating the file drops its gaps
+        tf.write(1, 1.5)
+    assert not os.path.exists(filename + ".gaps")
+
+
+def test_write_over_gap():
+    filename = gettempfilename()
+    with TeaFile.create(filename, "A B", "qd") as tf:
+        tf.write(1, 1.5)
+        tf.writegap(6)
+        tf.write(8, 8.5)
+        tf.seekitem(2)
+        tf.write(3, 3.5)
+        tf.seekitem(4)
+        tf.write_many([(5, 5.5), (6, 6.5)])
+        tf.seekitem(6)
+        tf.write(7, 7.5)
+    with TeaFile.openread(filename) as tf:
+        assert [item.A for item in tf.items()] == [1, 0, 3, 0, 5, 6, 7, 8]
+        assert [math.isnan(b) for b in tf.columns().B] == [False, True, False, True, False, False, False, False]
+    with TeaFile.openwrite(filename) as tf:
+        tf.seekitem(1)
+        tf.write(2, 2.5)
+        tf.seekitem(3)
+        tf.write(4, 4.5)
+    with TeaFile.openread(filename) as tf:
+        assert list(tf.columns().B) == [1.5, 2.5, 3.5, 4.5, 5.5, 6.5, 7.5, 8.5]
+
+
+def test_columns():
+    filename = gettempfilename()
+    with TeaFile.create(filename, "A B C", "qdf") as tf:
+        for i in range(100):
+            tf.write(i, i * 0.5, i * 2)
+    with TeaFile.openread(filename) as tf:
+        c = tf.columns()
+        assert list(c.A) == range(100)
+        assert list(c.B) == [item.B for item in tf.items()]
+        assert list(c.C) == [item.C for item in tf.items()]
+        c = tf.columns(90, 200)
+        assert list(c.A) == range(90, 100)
+        assert len(tf.columns(100).A) == 0
+    with TeaFile.create(filename, "A B", "qd") as tf:    # the file being written
+        tf.write(1, 1.5)
+        tf.write(2, 2.5)
+        assert list(tf.columns().B) == [1.5, 2.5]
+        tf.write(3, 3.5)
+        assert list(tf.columns(1).A) == [2, 3]
+
+
+def test_seektime():
+    filename = gettempfilename()
+    with TeaFile.create(filename, "Time Price", "qd") as tf:
+        for i in range(1000):
+            tf.write(DateTime(2011, 1, 1) + Duration(minutes=2 * i), float(i))
+        tf.writegap(10)
+        tf.write(DateTime(2011, 1, 3), 1000.0)
+    with TeaFile.openread(filename) as tf:
+        assert tf.seektime(DateTime(2010, 1, 1)) == 0
+        assert tf.seektime(DateTime(2011, 1, 1, 0, 3)) == 2
+        assert tf.read().Price == 2.0
+        assert tf.seektime(DateTime(2011, 1, 1, 0, 4).ticks) == 2
+        assert tf.seektime(DateTime(2011, 1, 2, 12)) == 1010     # after the gap
+        assert tf.seektime(DateTime(2012, 1, 1)) == 1011
+        prices = [item.Price for item in tf.items_between(DateTime(2011, 1, 1, 1), DateTime(2011, 1, 1, 1, 10))]
+        assert prices == [30.0, 31.0, 32.0, 33.0, 34.0]
+        assert list(tf.items_between(DateTime(2011, 1, 1, 1, 1), DateTime(2011, 1, 1, 1, 2))) == []
+    with TeaFile.create(filename, "Time Price", "qd") as tf:    # the file being written
+        for i in range(10):
+            tf.write(DateTime(2011, 1, 1) + Duration(minutes=i), float(i))
+        assert tf.seektime(DateTime(2011, 1, 1, 0, 4)) == 4
+        tf.seekend()
+        tf.write(DateTime(2011, 1, 1, 0, 10), 10.0)
+        assert [item.Price for item in tf.items_between(DateTime(2011, 1, 1, 0, 8), DateTime(2011, 1, 2))] == [8.0, 9.0, 10.0]
+    with TeaFile.create(filename, "A B") as tf:
+        try:
+            tf.seektime(0)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_header_cache(monkeypatch):
+    from teafiles import teafile
+    readheader = teafile._HeaderManager.readheader
+    headerreads = []
+    def countingreadheader(self, r):
+        headerreads.append(r)
+        return readheader(self, r)
+    monkeypatch.setattr(teafile._HeaderManager, "readheader", countingreadheader)
+
+    filename = gettempfilename()
+    with TeaFile.create(filename, "Time A", "qd", "cached", {"decimals": 2}) as tf:
+        tf.write(DateTime(2011, 3, 1), 1.5)
+    for _ in range(3):
+        with TeaFile.openread(filename) as tf:
+            assert tf.description.contentdescription == "cached"
+            assert tf.decimals == 2
+            assert list(tf.items()) == [(DateTime(2011, 3, 1), 1.5)]
+    assert len(headerreads) == 1
+    with TeaFile.openwrite(filename) as tf:     # same header, no parsing nor write method generation
+        tf.write(DateTime(2011, 3, 2), 2.5)
+    assert len(headerreads) == 1
+    with TeaFile.openread(filename) as tf:      # the file changed since it was cached
+        assert tf.itemcount == 2
+        assert tf.read().A == 1.5
+    assert len(headerreads) == 2
+    with TeaFile.create(filename, "B", "q") as tf:
+        tf.write(7)
+    with TeaFile.openread(filename) as tf:
+        assert tf.read() == (7,)
+    assert len(headerreads) == 3
+
+
 if __name__ == '__main__':
     pass
     # to be run with pytest. for debugging purposes, tests may be executed here.
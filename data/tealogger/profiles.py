@@ -0,0 +1,105 @@
+import fnmatch
+import math
+
+# The metrics tealogger records, per kind of D-Bus service.
+#
+# A profile matches service names with a shell style pattern and lists the
+# paths logged for these services, with their TeaFile format character.
+# Cumulative metrics are counters, like energy meters, whose values missed while
+# tealogger was not running can be interpolated.
+
+class Metric:
+    def __init__(self, path, datatype='f', cumulative=False):
+        self._path = path
+        self._datatype = datatype
+        self._cumulative = cumulative
+
+    def name(self):
+        return self._path[1:].replace('/', '_')
+
+    def path(self):
+        return self._path
+
+    def datatype(self):
+        return self._datatype
+
+    def cumulative(self):
+        return self._cumulative
+
+    def empty(self):
+        return float('nan')
+
+    def is_empty(self, val):
+        return math.isnan(val)
+
+    def cast(self, val):
+        return float(val)
+
+class Profile:
+    def __init__(self, name, pattern, metrics):
+        self.name = name
+        self.pattern = pattern
+        self.metrics = metrics
+
+    def matches(self, serviceName):
+        return fnmatch.fnmatchcase(serviceName, self.pattern)
+
+def metrics(*paths):
+    return [Metric(path) for path in paths]
+
+def counters(*paths):
+    return [Metric(path, cumulative=True) for path in paths]
+
+PROFILES = [
+    Profile('battery', 'com.victronenergy.battery.*', counters(
+        '/History/DischargedEnergy',
+        '/History/ChargedEnergy')),
+    Profile('pzem016', 'fr.mildred.pzemvictron2020.pzem016.*', counters(
+        '/Ac/TotalEnergy') + metrics(
+        '/Ac/Power',
+        '/Ac/Current',
+        '/Ac/Voltage',
+        '/Ac/Frequency',
+        '/Ac/PowerFactor')),
+    Profile('grid', 'com.victronenergy.grid.*', counters(
+        '/Ac/Energy/Forward',
+        '/Ac/Energy/Reverse') + metrics(
+        '/Ac/Power',
+        '/Ac/L1/Power',
+        '/Ac/L2/Power',
+        '/Ac/L3/Power',
+        '/Ac/L1/Voltage')),
+    Profile('pvinverter', 'com.victronenergy.pvinverter.*', counters(
+        '/Ac/Energy/Forward') + metrics(
+        '/Ac/Power',
+        '/Ac/L1/Power',
+        '/Ac/L2/Power',
+        '/Ac/L3/Power')),
+    Profile('vebus', 'com.victronenergy.vebus.*', metrics(
+        '/Ac/ActiveIn/P',
+        '/Ac/Out/P',
+        '/Dc/0/Voltage',
+        '/Dc/0/Current',
+        '/Soc') + counters(
+        '/Energy/InverterToAcOut',
+        '/Energy/AcIn1ToAcOut',
+        '/Energy/AcIn1ToInverter',
+        '/Energy/OutToInverter')),
+]
+
+def find_profile(serviceName, profiles=PROFILES):
+    ''' the first of profiles matching serviceName, None if none does '''
+    for profile in profiles:
+        if profile.matches(serviceName):
+            return profile
+    return None
+
+def select_profiles(names):
+    ''' the profiles named in the comma separated list names '''
+    selected = []
+    for name in names.split(','):
+        found = [p for p in PROFILES if p.name == name.strip()]
+        if not found:
+            raise ValueError("Unknown profile %s, expected one of %s" % (name, ', '.join(p.name for p in PROFILES)))
+        selected.extend(found)
+    return selected
@@ -0,0 +1,175 @@
+import csv
+import datetime
+import json
+import os
+import re
+import sys
+
+from storage import Aggregate, open_series, log_path, epoch
+
+# Aggregated reads of the series logged by tealogger.
+#
+# query reads the series by chunks of at most CHUNK rows, from the coarsest tier
+# whose rows divide the requested resolution: the hourly or daily rollups from
+# the first bucket they hold, the logged slots otherwise. Each interval of the resolution yields
+# the sum of the deltas, the mean and the max of each field, so that memory use
+# does not depend on the range read. Read from the rollups, the mean is the
+# mean of their rows, whatever the number of slots with data in each of them.
+
+AGGREGATES = ('delta', 'mean', 'max')
+CHUNK = 7 * 24 * 60
+NAN = float('nan')
+
+def parse_duration(s):
+    ''' seconds of a duration like 90, 90s, 15m, 1h or 1d '''
+    m = re.match(r'^(\d+)([smhd]?)$', s.strip())
+    if not m:
+        raise ValueError("Invalid duration %s" % s)
+    return int(m.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}[m.group(2)]
+
+def parse_time(s):
+    for f in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(s, f)
+        except ValueError:
+            pass
+    raise ValueError("Invalid time %s, expected YYYY-MM-DD[THH:MM[:SS]]" % s)
+
+## Returns the seconds per row of the coarsest tier of series dividing width
+# seconds and holding the slot of datetime when, and the datetime from which a
+# coarser tier holds the slots, None if none does.
+def tier(series, width, when):
+    tiers = [(r.size * 60, r) for r in series.rollups if width % (r.size * 60) == 0]
+    size = series.resolution
+    for s, r in tiers:
+        if r.covers(when):
+            size = s
+    starts = [r.start for s, r in tiers if s > size and r.start is not None]
+    return size, min(starts) if starts else None
+
+## Yields (datetime, [(delta, mean, max) of each field]) for each interval of
+# width seconds of [start, end). start is aligned on the interval, and the
+# delta of a field is computed as in the rollups: the increase of its value
+# from the slot before the interval, or from its first value in the interval
+# when that slot has no data.
+def query(series, fields, start, end, width):
+    if width % series.resolution:
+        raise ValueError("The resolution must be a multiple of %ds" % series.resolution)
+    start -= datetime.timedelta(seconds=epoch(start) % width)
+    previous = [None] * len(fields)
+    t = start
+    while t < end:
+        size, until = tier(series, width, t)
+        raw = size == series.resolution
+        perinterval = width // size
+        intervals = max(1, CHUNK // perinterval)
+        chunkend = min(t + datetime.timedelta(seconds=width * intervals), end)
+        if until is not None:
+            # the intervals from until are read from the coarser tier
+            chunkend = min(chunkend, until + datetime.timedelta(seconds=-epoch(until) % width))
+        n = -(-int((chunkend - t).total_seconds()) // width)
+        chunkend = t + datetime.timedelta(seconds=width * n)
+        step, first, columns = series.query(t, chunkend, datetime.timedelta(seconds=size))
+        if raw:
+            sources = [getattr(columns, f) for f in fields]
+        else:
+            sources = [(getattr(columns, f + '_delta'), getattr(columns, f + '_mean'), getattr(columns, f + '_max')) for f in fields]
+        for k in range(n):
+            a, b = k * perinterval, (k + 1) * perinterval
+            values = []
+            for i, source in enumerate(sources):
+                if raw:
+                    aggregates = aggregate(source[a:b], previous[i])
+                    previous[i] = source[b - 1]
+                else:
+                    aggregates = aggregate_rollup(source[0][a:b], source[1][a:b], source[2][a:b])
+                values.append(aggregates)
+            yield t + datetime.timedelta(seconds=k * width), values
+        t = chunkend
+
+def valid(values):
+    return [v for v in values if v == v]
+
+def aggregate(values, previous):
+    ''' the (delta, mean, max) of the slots values, previous being the value of the slot before '''
+    a = Aggregate(previous if previous == previous else None)
+    for value in values:
+        a.add(value)
+    min_, max_, mean, last, delta = a.values()
+    return (delta, mean, max_)
+
+def aggregate_rollup(deltas, means, maxes):
+    ''' the (delta, mean, max) of rollup rows '''
+    deltas, means, maxes = valid(deltas), valid(means), valid(maxes)
+    if not means:
+        return (NAN, NAN, NAN)
+    return (sum(deltas), sum(means) / len(means), max(maxes))
+
+def header(fields):
+    return ['time'] + ['%s_%s' % (f, a) for f in fields for a in AGGREGATES]
+
+def isotime(when):
+    return when.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def write_csv(out, fields, rows):
+    w = csv.writer(out, lineterminator='\n')
+    w.writerow(header(fields))
+    for when, values in rows:
+        w.writerow([isotime(when)] + ['' if v != v else repr(v) for aggregates in values for v in aggregates])
+
+def write_json(out, fields, rows):
+    for when, values in rows:
+        item = {'time': isotime(when)}
+        for f, aggregates in zip(fields, values):
+            item[f] = dict((a, None if v != v else v) for a, v in zip(AGGREGATES, aggregates))
+        out.write(json.dumps(item, sort_keys=True) + '\n')
+
+FORMATS = {
+    'csv': write_csv,
+    'json': write_json,
+}
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options] -s SERVICE [METRIC...]")
+    parser.add_option("-d", "--datadir", dest="datadir", default="/data/tealog",
+                      help="data directory", metavar="DIR")
+    parser.add_option("-s", "--service", dest="service",
+                      help="D-Bus service name of the log to read", metavar="SERVICE")
+    parser.add_option("--from", dest="start", metavar="TIME",
+                      help="start of the range, YYYY-MM-DD[THH:MM[:SS]] UTC (default 7 days ago)")
+    parser.add_option("--to", dest="end", metavar="TIME",
+                      help="end of the range, excluded (default now)")
+    parser.add_option("-r", "--resolution", dest="resolution", default="1h", metavar="DURATION",
+                      help="interval of the rows, like 15m, 1h or 1d (default %default)")
+    parser.add_option("-f", "--format", dest="format", type="choice", choices=sorted(FORMATS), default="csv",
+                      help="output format, csv or json lines (default %default)")
+    parser.add_option("--capture", dest="capture", default="sample",
+                      help="capture mode of the log, as given to tealogger (default %default)")
+    parser.add_option("--slot", dest="slot", type="int", default=60, metavar="SECONDS",
+                      help="resolution of the log, as given to tealogger (default %default)")
+    (opts, args) = parser.parse_args()
+
+    if not opts.service:
+        parser.error("--service is required")
+    try:
+        width = parse_duration(opts.resolution)
+        end = parse_time(opts.end) if opts.end else datetime.datetime.utcnow()
+        start = parse_time(opts.start) if opts.start else end - datetime.timedelta(days=7)
+    except ValueError as e:
+        parser.error(str(e))
+
+    fpath = log_path(os.path.join(opts.datadir, 'log-%s.tea' % opts.service), opts.capture, opts.slot)
+    try:
+        series = open_series(fpath, opts.slot)
+    except IOError as e:
+        parser.error(str(e))
+    fields = [m[1:].replace('/', '_') if m.startswith('/') else m for m in args] or series.fieldnames
+    unknown = [f for f in fields if f not in series.fieldnames]
+    if unknown:
+        parser.error("Unknown metrics %s, the log has %s" % (', '.join(unknown), ', '.join(series.fieldnames)))
+
+    try:
+        FORMATS[opts.format](sys.stdout, fields, query(series, fields, start, end, width))
+    except ValueError as e:
+        parser.error(str(e))
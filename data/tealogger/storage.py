@@ -0,0 +1,625 @@
+import calendar
+import datetime
+import errno
+import json
+import logging
+import os
+import re
+from collections import namedtuple
+
+from teafiles.teafile import TeaFile, FieldType
+
+# Storage of the series written by tealogger.
+#
+# A series holds one item per slot, a minute unless another resolution is given
+# in seconds. It is split in TeaFiles covering a day or a month, its partitions.
+# Each partition is named after the date it starts on and holds one item per
+# slot from that date. The manifest, a JSON file next to the partitions, lists them
+# with their date range, so that readers only open the files overlapping the
+# requested range, and partitions older than the retention period are deleted
+# as new ones are created.
+#
+# Hourly and daily rollups are kept next to the series, in <base>-hour.tea and
+# <base>-day.tea. They hold one item per hour or day with the min, max, mean,
+# last value and delta of each field, and are updated as minutes are written so
+# that long range queries read a few hundred items instead of every minute.
+# Rollups enabled on an existing series start with the first write: the
+# datetime of their first bucket is recorded in their header, and the ranges
+# before it are read from the series.
+#
+# Writes are flushed every minute but only synced to the storage device every
+# syncinterval minutes, to limit the wear of the flash memory. A crash loses at
+# most the minutes written since the last sync: the partial item it may leave
+# is truncated when the file is reopened, and the current rollup buckets are
+# rebuilt from the minutes on disk.
+#
+# Values that were not measured but estimated, like counters interpolated over
+# an outage, are written with the ranges they cover. These ranges are listed in
+# <base>-estimated.tea, as Start and End seconds since the epoch and the index
+# of the Field.
+#
+# With the 'none' partitioning, the series is a single file starting at the
+# date it was created on, as written by previous versions of tealogger.
+
+PARTITIONS = ('none', 'day', 'month')
+TIERS = (('hour', 60), ('day', 24 * 60))
+AGGREGATES = ('min', 'max', 'mean', 'last', 'delta')
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+BACKFILL_CHUNK = 10000
+
+def partition_range(partition, date):
+    ''' the [start, end) dates of the partition holding date '''
+    if partition == 'day':
+        return date, date + datetime.timedelta(days=1)
+    if partition == 'month':
+        start = date.replace(day=1)
+        return start, (start + datetime.timedelta(days=32)).replace(day=1)
+    raise ValueError("Unknown partitioning %s" % partition)
+
+def midnight(date):
+    return datetime.datetime.combine(date, datetime.time())
+
+def minutes(start, end):
+    ''' the number of minutes between datetimes start and end '''
+    delta = end - start
+    return delta.days * 24 * 60 + delta.seconds // 60
+
+def slots(start, end, resolution):
+    ''' the number of slots of resolution seconds between datetimes start and end '''
+    delta = end - start
+    return (delta.days * 24 * 3600 + delta.seconds) // resolution
+
+def empty_value(formatchar):
+    return float('nan') if formatchar in 'fd' else 0
+
+def epoch(when):
+    return calendar.timegm(when.utctimetuple())
+
+def parse_date(s):
+    return datetime.datetime.strptime(s, '%Y-%m-%d').date()
+
+def fill(tf, n, emptyitem, sparse):
+    ''' fills the items of tf up to n with emptyitem, or a gap if sparse '''
+    tf.seekend()
+    num_empty = n - tf.itemcount
+    if num_empty > 0 and sparse:
+        tf.writegap(num_empty)
+        logging.debug("Skipped %d empty records", num_empty)
+    elif num_empty > 0:
+        tf.write_many([emptyitem] * num_empty)
+        logging.debug("Filled in with %d empty records", num_empty)
+
+def empty_columns(fieldformat, n):
+    import array
+    columns = []
+    for c in fieldformat:
+        try:
+            columns.append(array.array(c, [empty_value(c)]) * n)
+        except ValueError:
+            columns.append([empty_value(c)] * n)
+    return columns
+
+def concatenate(columntype, chunks):
+    from teafiles import teafile
+    columns = []
+    for i in range(len(columntype._fields)):
+        parts = [chunk[i] for chunk in chunks]
+        if teafile.numpy:
+            columns.append(teafile.numpy.concatenate([teafile.numpy.asarray(p) for p in parts]))
+        else:
+            column = parts[0][:]
+            for p in parts[1:]:
+                column.extend(p)
+            columns.append(column)
+    return columntype(*columns)
+
+def origindate(tf):
+    nvs = tf.description.namevalues
+    return datetime.date(int(nvs['year']), int(nvs['month']), int(nvs['day']))
+
+def create(fpath, fieldnames, fieldformat, contentdescription, date, namevalues=None):
+    logging.debug('%s: fields=%s types=%s' % (fpath, ' '.join(fieldnames), fieldformat))
+    nvs = {
+        'year':  date.year,
+        'month': date.month,
+        'day':   date.day,
+    }
+    nvs.update(namevalues or {})
+    return TeaFile.create(fpath, ' '.join(fieldnames), fieldformat, contentdescription, nvs)
+
+def log_path(fpath, capture='sample', resolution=60):
+    ''' the file of the series logged as fpath, with another capture mode or resolution '''
+    if capture == 'sample' and resolution == 60:
+        return fpath
+    base, ext = os.path.splitext(fpath)
+    return '%s-%s-%ds%s' % (base, capture, resolution, ext)
+
+## Returns the partitioning and the partitions of the series <base>, read from
+# its manifest. A manifest missing or corrupted by a crash is rebuilt from the
+# names of the partitions, as partitioned as partition if given.
+def load_manifest(base, partition=None):
+    manifestpath = base + '.manifest'
+    try:
+        with open(manifestpath) as f:
+            manifest = json.load(f)
+        return manifest['partition'], manifest['partitions']
+    except (IOError, ValueError, KeyError) as e:
+        if os.path.exists(manifestpath):
+            logging.warning("%s: unreadable manifest (%s), rebuilding it from the partitions" % (manifestpath, e))
+    pattern = re.compile(re.escape(os.path.basename(base)) + r'-(\d{8})\.tea$')
+    directory = os.path.dirname(base) or '.'
+    names = [pattern.match(name) for name in (os.listdir(directory) if os.path.isdir(directory) else [])]
+    dates = sorted(datetime.datetime.strptime(m.group(1), '%Y%m%d').date() for m in names if m)
+    if not dates:
+        return partition or 'none', []
+    if partition in (None, 'none'):
+        # month partitions start on the first of the month
+        days = any(d.day != 1 for d in dates) or any((b - a).days < 28 for a, b in zip(dates, dates[1:]))
+        partition = 'day' if days else 'month'
+    partitions = []
+    for date in dates:
+        start, end = partition_range(partition, date)
+        partitions.append({'file': '%s-%s.tea' % (os.path.basename(base), date.strftime('%Y%m%d')), 'start': str(start), 'end': str(end)})
+    return partition, partitions
+
+def save_atomically(fpath, write):
+    ''' writes fpath with write(file), so that a crash leaves either the previous or the new content '''
+    temporary = fpath + '.tmp'
+    with open(temporary, 'w') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temporary, fpath)
+    fd = os.open(os.path.dirname(fpath) or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def open_series(fpath, resolution=60):
+    ''' the PartitionedSeries written as fpath, with its partitioning and rollups, to read it '''
+    base = os.path.splitext(fpath)[0]
+    partition, partitions = load_manifest(base)
+    files = [os.path.join(os.path.dirname(fpath), p['file']) for p in partitions] or [fpath]
+    files = [f for f in files if os.path.exists(f)]
+    if not files:
+        raise IOError(errno.ENOENT, "No series logged", fpath)
+    with TeaFile.openread(files[-1]) as tf:
+        id_ = tf.description.itemdescription
+        fieldformat = ''.join([FieldType.getformatcharacter(f.fieldtype) for f in id_.fields])
+        series = PartitionedSeries(fpath, id_.fieldnames, fieldformat, tf.description.contentdescription,
+            partition=partition, rollup=os.path.exists(base + '-hour.tea'), resolution=resolution)
+    return series
+
+class PartitionedSeries:
+    def __init__(self, fpath, fieldnames, fieldformat, contentdescription=None, partition='none', retention=None, sparse=False, rollup=False, syncinterval=None, resolution=60):
+        if partition not in PARTITIONS:
+            raise ValueError("Unknown partitioning %s" % partition)
+        if 24 * 3600 % resolution:
+            raise ValueError("The resolution must divide a day, got %ds" % resolution)
+        self.fpath = fpath
+        self.fieldnames = fieldnames
+        self.columntype = namedtuple('Columns', fieldnames)
+        self.fieldformat = fieldformat
+        self.contentdescription = contentdescription
+        self.partition = partition
+        self.retention = retention      # days, None to keep everything
+        self.sparse = sparse
+        self.resolution = resolution    # seconds per item
+        self.syncinterval = syncinterval  # minutes between syncs, None to leave it to the system
+        self.unsynced = 0
+        self.byteswritten = 0           # bytes and flushes since the counters were last reset
+        self.flushes = 0
+        self.base = os.path.splitext(fpath)[0]
+        self.manifestpath = self.base + '.manifest'
+        self.partitions = self._load_manifest()
+        self.tf = None
+        self.start = None
+        self.end = None
+        self.rollups = [Rollup(self, tier, size) for tier, size in TIERS] if rollup else []
+        self.estimatedpath = self.base + '-estimated.tea'
+
+    def close(self):
+        if self.tf is not None:
+            self.sync()
+            self.tf.close()
+            self.tf = None
+        for r in self.rollups:
+            r.close()
+
+    ## Waits until the slots written are on the storage device.
+    def sync(self):
+        if self.tf is not None:
+            self.tf.fsync()
+        for r in self.rollups:
+            if r.tf is not None:
+                r.tf.fsync()
+        self.unsynced = 0
+
+    ## Writes the values of the slot of datetime when, filling the slots missed
+    # since the last write with empty items, and updates the rollups.
+    def write(self, when, values):
+        return self.write_many([(when, values)])
+
+    ## Writes the (datetime, values) rows of several slots, in increasing
+    # order. Consecutive slots are written with a single write per file and
+    # each file is flushed once. Returns the item index of the last row.
+    # estimated lists the (field name, start, end) datetime ranges of the values
+    # of rows that were estimated, see estimated. Rows before the start
+    # of their file, after the clock went back, are dropped.
+    def write_many(self, rows, estimated=()):
+        run = []
+        first = last = None
+        written = []
+        for when, values in rows:
+            if self.tf is None or not self._inpartition(when.date()):
+                self._append(first, run)
+                run = []
+                self._open_partition(when.date())
+            n = self._slots(midnight(self.start), when)
+            if n < 0:
+                continue
+            if run and n != first + len(run):
+                self._append(first, run)
+                run = []
+            if not run:
+                first = n
+            run.append(tuple(values))
+            written.append((when, values))
+            last = n
+        self._append(first, run)
+        if len(written) < len(rows):
+            logging.warning("%s: dropped %d rows before the start of the series" % (self.fpath, len(rows) - len(written)))
+        rows = written
+        if self.tf is not None:
+            self.tf.flush()
+            self.flushes += 1
+        # the rollups replay the slots on disk when they start a bucket
+        for r in self.rollups:
+            for when, values in rows:
+                r.update(when, values)
+            self.byteswritten += r.flush()
+            self.flushes += 1
+        self.unsynced += len(rows) * self.resolution / 60.0
+        if self.syncinterval is not None and self.unsynced >= self.syncinterval:
+            self.sync()
+        if estimated and rows:
+            self._add_estimated(estimated)
+        return last
+
+    ## Interpolates linearly the fields named in counters over the slots
+    # missed before when, from their last values written in the maxbackfill
+    # seconds before to values, the values of the slot at when. The other
+    # fields of these slots are left as they are, and each counter is recorded
+    # as estimated from its own last value. Counters that went down, like after
+    # a reset, are left alone. The slots are read and written by chunks of
+    # BACKFILL_CHUNK, so that memory use does not depend on maxbackfill.
+    # Returns the number of rows written.
+    def backfill(self, when, values, counters, maxbackfill):
+        start = when - datetime.timedelta(seconds=maxbackfill)
+        start -= datetime.timedelta(seconds=epoch(start) % self.resolution)
+        def slot(k):
+            return start + datetime.timedelta(seconds=k * self.resolution)
+        n = self._slots(start, when)
+        anchors = {}    # field index -> index and value of its last record
+        pending = [self.fieldnames.index(name) for name in counters]
+        # the last records are searched from when backwards
+        end = n
+        while pending and end > 0:
+            first = max(end - BACKFILL_CHUNK, 0)
+            columns = self.columns(slot(first), slot(end))
+            for i in list(pending):
+                k = next((k for k in xrange(end - first - 1, -1, -1) if columns[i][k] == columns[i][k]), None)
+                if k is None:
+                    continue
+                pending.remove(i)
+                # nothing missed, or the counter was reset
+                if first + k < n - 1 and columns[i][k] <= values[i]:
+                    anchors[i] = (first + k, columns[i][k])
+            end = first
+        if not anchors:
+            return 0
+        # the ranges are recorded with the first chunk, so that a crash leaves
+        # no interpolated slot unmarked
+        estimated = [(self.fieldnames[i], slot(last + 1), slot(n)) for i, (last, value) in sorted(anchors.items())]
+        written = 0
+        for first in xrange(min(last for last, value in anchors.values()) + 1, n, BACKFILL_CHUNK):
+            end = min(first + BACKFILL_CHUNK, n)
+            columns = self.columns(slot(first), slot(end))
+            # each row has at least one interpolated counter, the measured values are rewritten as they are
+            rows = []
+            for k in xrange(first, end):
+                row = [column[k - first] for column in columns]
+                for i, (last, value) in anchors.items():
+                    if k > last:
+                        row[i] = value + (values[i] - value) * (k - last) / float(n - last)
+                rows.append((slot(k), row))
+            self.write_many(rows, estimated)
+            estimated = ()
+            written += len(rows)
+        return written
+
+    ## Returns the (field name, start, end) of the [start, end) datetime ranges
+    # of estimated values overlapping [start, end).
+    def estimated(self, start, end):
+        if not os.path.exists(self.estimatedpath):
+            return []
+        with TeaFile.openread(self.estimatedpath) as tf:
+            c = tf.columns()
+        return [(self.fieldnames[f], datetime.datetime.utcfromtimestamp(s), datetime.datetime.utcfromtimestamp(e))
+            for s, e, f in zip(c.Start, c.End, c.Field) if s < epoch(end) and e > epoch(start)]
+
+    def _add_estimated(self, ranges):
+        if os.path.isfile(self.estimatedpath):
+            tf = TeaFile.openwrite(self.estimatedpath)
+        else:
+            tf = TeaFile.create(self.estimatedpath, 'Start End Field', 'qqq', self.contentdescription)
+        with tf:
+            tf.write_many([(epoch(start), epoch(end), self.fieldnames.index(name)) for name, start, end in ranges])
+
+    def _append(self, n, items):
+        ''' writes items at index n of the current partition '''
+        if not items:
+            return
+        fill(self.tf, n, tuple(empty_value(c) for c in self.fieldformat), self.sparse)
+        self.tf.seekitem(n)
+        self.tf.write_many(items)
+        self.byteswritten += len(items) * self.tf.itemsize
+
+    ## Returns (timedelta per row, datetime of the first row, columns) for the
+    # range [start, end), read from the coarsest tier whose rows are no longer
+    # than the timedelta resolution. The rollup tiers have the fields
+    # <field>_min, <field>_max, <field>_mean, <field>_last and <field>_delta.
+    def query(self, start, end, resolution=datetime.timedelta(minutes=1)):
+        tier = None
+        for r in self.rollups:
+            if datetime.timedelta(minutes=r.size) <= resolution and r.covers(start):
+                tier = r
+        if tier is None:
+            return datetime.timedelta(seconds=self.resolution), start, self.columns(start, end)
+        first, columns = tier.columns(start, end)
+        return datetime.timedelta(minutes=tier.size), first, columns
+
+    ## Returns the values of the slots in [start, end) as a named tuple of
+    # columns, see TeaFile.columns. Slots without data hold empty values.
+    def columns(self, start, end):
+        total = self._slots(start, end)
+        chunks = []
+        filled = 0
+        for fpath, pstart, pend in self._overlapping(start.date(), end):
+            if not os.path.exists(fpath):
+                continue
+            origin = midnight(pstart)
+            first = max(self._slots(origin, start), 0)
+            last = self._slots(origin, end)
+            if pend is not None:
+                last = min(last, self._slots(origin, midnight(pend)))
+            if last <= first:
+                continue
+            offset = self._slots(start, origin) + first
+            if offset > filled:
+                chunks.append(self._empty_columns(offset - filled))
+            with TeaFile.openread(fpath) as tf:
+                columns = tf.columns(first, last)
+            chunks.append(columns)
+            if len(columns[0]) < last - first:
+                chunks.append(self._empty_columns(last - first - len(columns[0])))
+            filled = offset + last - first
+        if filled < total or not chunks:
+            chunks.append(self._empty_columns(max(total - filled, 0)))
+        return self._concatenate(chunks)
+
+    def _overlapping(self, startdate, end):
+        ''' the (file, start date, end date) of the partitions overlapping [startdate, end) '''
+        if self.partition == 'none':
+            if not os.path.exists(self.fpath):
+                return []
+            with TeaFile.openread(self.fpath) as tf:
+                return [(self.fpath, origindate(tf), None)]
+        enddate = end.date() if end.time() == datetime.time() else end.date() + datetime.timedelta(days=1)
+        return [(os.path.join(os.path.dirname(self.fpath), p['file']), parse_date(p['start']), parse_date(p['end']))
+            for p in self.partitions if parse_date(p['start']) < enddate and parse_date(p['end']) > startdate]
+
+    def _slots(self, start, end):
+        return slots(start, end, self.resolution)
+
+    def _empty_columns(self, n):
+        return empty_columns(self.fieldformat, n)
+
+    def _concatenate(self, chunks):
+        return concatenate(self.columntype, chunks)
+
+    def _inpartition(self, date):
+        return self.start <= date and (self.end is None or date < self.end)
+
+    def _open_partition(self, date):
+        if self.tf is not None and self._inpartition(date):
+            return self.tf
+        self.close()
+        if self.partition == 'none':
+            self.tf = self._open(self.fpath, date)
+            self.start, self.end = origindate(self.tf), None
+            return self.tf
+        self.start, self.end = partition_range(self.partition, date)
+        filename = "%s-%s.tea" % (os.path.basename(self.base), self.start.strftime('%Y%m%d'))
+        self.tf = self._open(os.path.join(os.path.dirname(self.fpath), filename), self.start)
+        if filename not in [p['file'] for p in self.partitions]:
+            self.partitions.append({'file': filename, 'start': str(self.start), 'end': str(self.end)})
+            self.partitions.sort(key=lambda p: p['start'])
+            self._expire(date)
+            self._save_manifest()
+        return self.tf
+
+    def _open(self, fpath, date):
+        if os.path.isfile(fpath):
+            return TeaFile.openwrite(fpath)
+        return create(fpath, self.fieldnames, self.fieldformat, self.contentdescription, date)
+
+    def _expire(self, today):
+        ''' deletes the partitions past the retention period '''
+        if self.retention is None:
+            return
+        limit = today - datetime.timedelta(days=self.retention)
+        for p in [p for p in self.partitions if parse_date(p['end']) <= limit]:
+            logging.info("Removing %s, older than %d days" % (p['file'], self.retention))
+            fpath = os.path.join(os.path.dirname(self.fpath), p['file'])
+            for f in (fpath, fpath + '.gaps'):
+                if os.path.exists(f):
+                    os.remove(f)
+            self.partitions.remove(p)
+
+    def _load_manifest(self):
+        if self.partition == 'none':
+            return []
+        return load_manifest(self.base, self.partition)[1]
+
+    def _save_manifest(self):
+        save_atomically(self.manifestpath,
+            lambda f: json.dump({'partition': self.partition, 'partitions': self.partitions}, f, indent=1))
+
+class Aggregate:
+    ''' min, max, mean, last and delta of the values of a rollup bucket '''
+    __slots__ = ('min', 'max', 'sum', 'count', 'baseline', 'last')
+
+    def __init__(self, baseline=None):
+        self.min = None
+        self.max = None
+        self.sum = 0
+        self.count = 0
+        self.baseline = baseline    # last value before the bucket, for delta
+        self.last = None
+
+    def add(self, value):
+        if value != value:          # nan, minute without data
+            return
+        if self.count == 0:
+            self.min = self.max = value
+            if self.baseline is None:
+                self.baseline = value
+        else:
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+        self.sum += value
+        self.count += 1
+        self.last = value
+
+    def values(self):
+        if self.count == 0:
+            return (float('nan'),) * len(AGGREGATES)
+        return (self.min, self.max, self.sum / float(self.count), self.last, self.last - self.baseline)
+
+class Rollup:
+    ''' the hourly or daily aggregates of a PartitionedSeries '''
+    def __init__(self, series, tier, size):
+        self.series = series
+        self.tier = tier
+        self.size = size            # minutes per item
+        self.fpath = '%s-%s.tea' % (series.base, tier)
+        self.fieldnames = ['%s_%s' % (name, a) for name in series.fieldnames for a in AGGREGATES]
+        self.fieldformat = 'd' * len(self.fieldnames)
+        self.columntype = namedtuple('Columns', self.fieldnames)
+        self.tf = None
+        self.origin = None
+        self.start = None           # the first bucket aggregated, the ones before are empty
+        self.bucket = None
+        self.aggregates = None
+        self.dirty = False
+
+    def close(self):
+        if self.tf is not None:
+            self.flush()
+            self.tf.close()
+            self.tf = None
+            self.bucket = None
+
+    ## Adds the values of the minute of datetime when to its bucket. The
+    # bucket item is written when the next bucket starts or on flush.
+    def update(self, when, values):
+        if self.tf is None:
+            self._open(when)
+        n = minutes(self.origin, when) // self.size
+        if n < 0:
+            logging.warning("%s: dropped the slot of %s, before the start of the rollup" % (self.fpath, when))
+            return
+        if n != self.bucket:
+            self._write()
+            self._load(n, when)
+        for a, value in zip(self.aggregates, values):
+            a.add(value)
+        self.dirty = True
+
+    ## Writes the current bucket and flushes the file, returns the number of
+    # bytes written.
+    def flush(self):
+        if self.tf is None:
+            return 0
+        written = self._write()
+        self.tf.flush()
+        return written
+
+    def _write(self):
+        if not self.dirty:
+            return 0
+        fill(self.tf, self.bucket, (float('nan'),) * len(self.fieldnames), self.series.sparse)
+        self.tf.seekitem(self.bucket)
+        self.tf.write(*[v for a in self.aggregates for v in a.values()])
+        self.dirty = False
+        return self.tf.itemsize
+
+    ## Returns whether the buckets from datetime when on hold the aggregates of
+    # the series. The rollups are started by the first write after they are
+    # enabled, the slots written before are only in the series.
+    def covers(self, when):
+        self._readheader()
+        return self.start is not None and self.start <= when
+
+    ## Returns (datetime of the first bucket, columns) of the buckets
+    # overlapping [start, end).
+    def columns(self, start, end):
+        self._readheader()
+        origin = self.origin or midnight(start.date())
+        first = minutes(origin, start) // self.size
+        last = -(-minutes(origin, end) // self.size)
+        chunks = []
+        if first < 0:
+            chunks.append(empty_columns(self.fieldformat, min(-first, max(last - first, 0))))
+        if last > max(first, 0) and os.path.exists(self.fpath):
+            with TeaFile.openread(self.fpath) as tf:
+                chunks.append(tf.columns(max(first, 0), last))
+        filled = sum(len(c[0]) for c in chunks)
+        if filled < last - first or not chunks:
+            chunks.append(empty_columns(self.fieldformat, max(last - first - filled, 0)))
+        return origin + datetime.timedelta(minutes=first * self.size), concatenate(self.columntype, chunks)
+
+    def _open(self, when):
+        if os.path.isfile(self.fpath):
+            self.tf = TeaFile.openwrite(self.fpath)
+        else:
+            origin = midnight(when.date())
+            start = origin + datetime.timedelta(minutes=minutes(origin, when) // self.size * self.size)
+            self.tf = create(self.fpath, self.fieldnames, self.fieldformat, self.series.contentdescription, when.date(),
+                {'start': start.strftime(DATETIME_FORMAT)})
+        self._setorigin(self.tf)
+
+    def _readheader(self):
+        if self.origin is None and os.path.exists(self.fpath):
+            with TeaFile.openread(self.fpath) as tf:
+                self._setorigin(tf)
+
+    def _setorigin(self, tf):
+        self.origin = midnight(origindate(tf))
+        start = tf.description.namevalues.get('start')
+        self.start = datetime.datetime.strptime(start, DATETIME_FORMAT) if start else self.origin
+
+    def _load(self, n, when):
+        ''' starts bucket n, replaying the slots already written before when '''
+        start = self.origin + datetime.timedelta(minutes=n * self.size)
+        previous = self.series.columns(start - datetime.timedelta(seconds=self.series.resolution), when)
+        self.aggregates = []
+        for column in previous:
+            baseline = column[0] if column[0] == column[0] else None
+            a = Aggregate(baseline)
+            for value in column[1:]:
+                a.add(value)
+            self.aggregates.append(a)
+        self.bucket = n
@@ -0,0 +1,69 @@
+#!/usr/bin/env python2
+
+# Benchmark of the tealogger storage: writes a synthetic year of minutes of a
+# battery, with its rollups, in a temporary directory, then reads it back
+# through query at several resolutions.
+
+import datetime
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+for ext in os.listdir(os.path.join(os.path.dirname(__file__), 'ext')):
+    sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'ext', ext))
+
+from storage import PartitionedSeries
+from query import query
+
+FIELDS = ['History_ChargedEnergy', 'History_DischargedEnergy', 'Dc_0_Power', 'Soc']
+
+def synthetic_day(start):
+    ''' the (datetime, power) of the minutes of the day starting at start '''
+    return [(start + datetime.timedelta(minutes=minute), 1000.0 * math.sin(2 * math.pi * minute / (24 * 60)))
+            for minute in range(24 * 60)]
+
+def write_year(fpath, days, partition):
+    series = PartitionedSeries(fpath, FIELDS, 'ffff', 'tealogger benchmark', partition=partition, rollup=True)
+    start = datetime.datetime(2023, 1, 1)
+    charged = discharged = 0.0
+    began = time.time()
+    for day in range(days):
+        rows = []
+        for when, power in synthetic_day(start + datetime.timedelta(days=day)):
+            if power > 0:
+                charged += power / 60000.0
+            else:
+                discharged -= power / 60000.0
+            rows.append((when, [charged, discharged, power, 50 + power / 20]))
+        series.write_many(rows)
+    series.close()
+    elapsed = time.time() - began
+    print("Writing %d days of minutes %8.2f s" % (days, elapsed))
+    return series, start, start + datetime.timedelta(days=days)
+
+def read(series, start, end, width):
+    began = time.time()
+    rows = 0
+    for when, values in query(series, FIELDS, start, end, width):
+        rows += 1
+    elapsed = time.time() - began
+    print("Query at %6ds %7d rows %8.2f s" % (width, rows, elapsed))
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--days", dest="days", type="int", default=365,
+                      help="number of days of data (default %default)", metavar="N")
+    parser.add_option("--partition", dest="partition", default="month",
+                      help="partitioning of the series (default %default)")
+    (opts, args) = parser.parse_args()
+
+    datadir = tempfile.mkdtemp()
+    try:
+        series, start, end = write_year(os.path.join(datadir, 'log-bench.tea'), opts.days, opts.partition)
+        for width in (86400, 3600, 900):
+            read(series, start, end, width)
+    finally:
+        shutil.rmtree(datadir)
@@ -0,0 +1,18 @@
+#!/usr/bin/env python2
+
+# Prints the series logged by tealogger, aggregated at a given resolution, as
+# CSV or JSON lines. For instance the daily energy charged and discharged by a
+# battery over january:
+#
+#   tealogger-query.py -s com.victronenergy.battery.ttyO1 -r 1d \
+#       --from 2024-01-01 --to 2024-02-01 History_ChargedEnergy History_DischargedEnergy
+
+import os
+import sys
+for ext in os.listdir(os.path.join(os.path.dirname(__file__), 'ext')):
+    sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'ext', ext))
+
+import query
+
+if __name__ == "__main__":
+    query.main()
@@ -3,6 +3,8 @@
 import os
 import sys
 sys.path.insert(1, '/opt/victronenergy/vrmlogger/ext/velib_python')
+# velib_python of the pzem driver, with GetItems and VeDbusImportManager
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'pzem', 'ext', 'velib_python'))
 for ext in os.listdir(os.path.join(os.path.dirname(__file__), 'ext')):
     sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'ext', ext))
 
@@ -17,131 +19,150 @@ import dbus.service
 import time
 import datetime
 import math
+import signal
+import collections
 
-from teafiles.teafile import TeaFile
-from vedbus import VeDbusService, VeDbusItemImport
+from storage import PartitionedSeries, Aggregate, PARTITIONS, log_path
+from ticks import TickScheduler
+from profiles import PROFILES, find_profile, select_profiles
+from vedbus import VeDbusService, VeDbusImportManager
 
 ###########################################################
 
-class Metric:
-    def __init__(self, path, datatype='f'):
-        self._path = path
-        self._datatype = datatype
-
-    def name(self):
-        return self._path[1:].replace('/', '_')
-
-    def path(self):
-        return self._path
-
-    def datatype(self):
-        return self._datatype
-
-    def empty(self):
-        return float('nan')
-
-    def is_empty(self, val):
-        return math.isnan(val)
-
-    def cast(self, val):
-        return float(val)
+# sample: record the value of each metric at the start of each slot
+# events: record the min, max, mean, last value and count of the changes
+#         received during each slot
+CAPTURES = ('sample', 'events')
+EVENT_AGGREGATES = ('min', 'max', 'mean', 'last', 'count')
 
 class TeaBusLogger:
-    def __init__(self, fpath, bus, serviceName, metrics):
+    def __init__(self, fpath, bus, serviceName, metrics, sparse=False, partition='none', retention=None, rollup=True, syncinterval=None, buffered=1,
+                 capture='sample', resolution=60, scheduler=None, maxbackfill=None):
         self.metrics = metrics
-        self.metric_imports = {}
-        self.metric_values = {}
+        self.capture = capture
+        self.resolution = resolution    # seconds per slot
+        self.buffered = max(1, buffered * 60 // resolution)   # slots kept in memory before writing them
+        self.buffer = collections.deque()
+        # seconds of missed counter values interpolated on the first update, see backfill
+        self.maxbackfill = maxbackfill if capture == 'sample' and any(m.cumulative() for m in metrics) else None
         self.bus = bus
+        self.serviceName = serviceName
+        self.imports = VeDbusImportManager.get(bus)
         self.fpath = os.path.join(os.path.dirname(fpath), "by-minute-%s" % os.path.basename(fpath))
-        if os.path.isfile(fpath):
-            self.tf = TeaFile.openwrite(fpath)
+        if capture == 'events':
+            self.accumulators = dict((m.path(), Aggregate()) for m in metrics)
+            fieldnames = ['%s_%s' % (m.name(), a) for m in metrics for a in EVENT_AGGREGATES]
+            fieldformat = ''.join([m.datatype() * 4 + 'i' for m in metrics])
         else:
-            logging.debug('%s: fields=%s types=%s' % (fpath, ' '.join([m.name() for m in metrics]), ''.join([m.datatype() for m in metrics])))
-            now = time.gmtime()
-            self.tf = TeaFile.create(fpath,
-                ' '.join([m.name() for m in metrics]),
-                ''.join([m.datatype() for m in metrics]),
-                serviceName,
-                {
-                    'year':  now.tm_year,
-                    'month': now.tm_mon,
-                    'day':   now.tm_mday,
-                })
-
-        self.startdate = datetime.date(
-                int(self.tf.description.namevalues['year']),
-                int(self.tf.description.namevalues['month']),
-                int(self.tf.description.namevalues['day']))
+            fieldnames = [m.name() for m in metrics]
+            fieldformat = ''.join([m.datatype() for m in metrics])
+        # the items have another meaning, do not mix them with the default log
+        fpath = log_path(fpath, capture, resolution)
+        self.series = PartitionedSeries(fpath,
+            fieldnames,
+            fieldformat,
+            serviceName,
+            partition=partition,
+            retention=retention,
+            sparse=sparse,
+            rollup=rollup,
+            syncinterval=syncinterval,
+            resolution=resolution)
 
         for m in metrics:
             logging.debug("Watch %s%s"%(serviceName, m.path()))
-            self.metric_imports[m.path()] = VeDbusItemImport(self.bus, serviceName, m.path(), lambda x, y, z: self.import_value_changed(m, x, y, z))
+            self.imports.watch(serviceName, m.path(), self.import_value_changed)
 
-        self.install_update()
+        self.started = True
+        self.scheduler = scheduler or TickScheduler(resolution)
+        self.scheduler.add(self)
 
     def close(self):
         self.started = False
-        return self.tf.close()
-
-    def install_update(self, _from_timer=False):
-        self.started = True
-        tick = time.time()
-        now = time.gmtime(tick)
-        if _from_timer or now.tm_sec == 0:
-            if _from_timer: logging.debug("Install tick handler after initial timeout")
-            else: logging.debug("Install tick handler")
-            gobject.timeout_add_seconds(60, self.update)
-            self.update()
+        self.scheduler.remove(self)
+        for m in self.metrics:
+            self.imports.unwatch(self.serviceName, m.path(), self.import_value_changed)
+        self.flush()
+        return self.series.close()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        n = self.series.write_many(list(self.buffer))
+        logging.debug("records up to %d: %s" % (n, repr([values for when, values in self.buffer])))
+        self.buffer.clear()
+
+    ## Records the slot starting at boundary, in seconds since the epoch, the
+    # current time rounded to the resolution by default.
+    def update(self, boundary=None):
+        if not self.started:
+            return False
+        if boundary is None:
+            boundary = int(round(time.time() / self.resolution)) * self.resolution
+        if self.capture == 'events':
+            # the boundary ends the slot whose events were accumulated
+            slot = boundary - self.resolution
+            values = [v for m in self.metrics for v in self.get_aggregates(m)]
         else:
-            logging.debug("Install tick handler in %ds" % (60 - now.tm_sec))
-            gobject.timeout_add(int(1e3 * (60 - now.tm_sec)), lambda: self.install_update(_from_timer=True))
-        return not _from_timer
-
-    def update(self):
-        t = time.gmtime()
-        n = self.slot_num(t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min)
-        num_empty = 0
-        self.tf.seekend()
-        while self.tf.itemcount < n:
-            self.tf.write(*[m.empty() for m in self.metrics])
-            num_empty += 1
-        if num_empty > 0: logging.debug("Filled in with %d empty records", num_empty)
-        values = [self.get_metric(m) for m in self.metrics]
-        self.tf.seekitem(n)
-        self.tf.write(*values)
-        self.tf.flush()
-        logging.debug("record %d: %s" % (n, repr(values)))
-        #logging.debug("all items: %s" % ([ i for i in self.tf.items()]))
-        #logging.debug("last 10 items: %s" % ([ i for i in self.tf.items(n - 10, n+1)]))
+            slot = boundary
+            values = [self.get_metric(m) for m in self.metrics]
+        when = datetime.datetime.utcfromtimestamp(slot)
+        if self.maxbackfill:
+            self.backfill(when, values)
+        self.buffer.append((when, values))
+        if len(self.buffer) >= self.buffered:
+            self.flush()
+        if when.minute == 0 and when.second < self.resolution:
+            logging.info("%s: wrote %d bytes in %d flushes during the last hour" % (self.serviceName, self.series.byteswritten, self.series.flushes))
+            self.series.byteswritten = self.series.flushes = 0
         return self.started
 
-    def slot_num(self, year, month, day, hour, minute):
-        dmin = hour * 60 + minute
-        delta = datetime.date(year, month, day) - self.startdate
-        num = delta.days * 24 * 60 + dmin
-        #logging.debug("Slot num for %s %d/%d/%d %d:%d(%d) is %s %d" % (self.startdate, year, month, day, hour, minute, dmin, delta, num))
-        return num
+    ## Interpolates the counters over the slots missed before when, see
+    # PartitionedSeries.backfill. Waits for the counters to be imported from
+    # D-Bus, then runs once.
+    def backfill(self, when, values):
+        counters = [i for i, m in enumerate(self.metrics) if m.cumulative()]
+        if any(math.isnan(values[i]) for i in counters):
+            return
+        self.maxbackfill, maxbackfill = None, self.maxbackfill
+        self.flush()
+        n = self.series.backfill(when, values, [self.metrics[i].name() for i in counters], maxbackfill)
+        if n:
+            logging.info("%s: estimated %d missed records before %s" % (self.serviceName, n, when))
 
     def get_metric(self, metric):
-        return metric.cast(self.metric_imports[metric.path()].get_value())
-        #if metric.path() in self.metric_values:
-        #    return metric.cast(self.metric_values[metric.path()])
-        #else:
-        #    return metric.empty()
-
-    def import_value_changed(self, metric, serviceName, path, changes):
+        value = self.imports.get_value(self.serviceName, metric.path())
+        if value is None:
+            return metric.empty()
+        return metric.cast(value)
+
+    def get_aggregates(self, metric):
+        ''' the min, max, mean, last value and count of the changes of metric since the last call '''
+        a = self.accumulators[metric.path()]
+        self.accumulators[metric.path()] = Aggregate()
+        if a.count == 0:
+            # no change during the slot, the value held all along
+            value = self.get_metric(metric)
+            return (value, value, value, value, 0)
+        return (a.min, a.max, a.sum / float(a.count), a.last, a.count)
+
+    def import_value_changed(self, serviceName, path, changes):
         logging.debug('%s%s imported %s' % (serviceName, path, changes['Value']))
-        self.metric_values[metric.path()] = changes['Value']
-
-class TeaBatteryBusLogger(TeaBusLogger):
-    def __init__(self, fpath, bus, serviceName):
-        TeaBusLogger.__init__(self, fpath, bus, serviceName, [
-            Metric('/History/DischargedEnergy'),
-            Metric('/History/ChargedEnergy')
-        ])
-
+        if self.capture == 'events':
+            metric = [m for m in self.metrics if m.path() == path][0]
+            try:
+                self.accumulators[path].add(metric.cast(changes['Value']))
+            except (TypeError, ValueError):
+                pass    # invalid value
+
+## Logs the metrics of the services matching one of profiles, with a
+# TeaBusLogger created when the service appears on D-Bus. options are passed to
+# the loggers.
 class TeaLoggerService:
-    def __init__(self, datadir, dbusPrivate=False):
+    def __init__(self, datadir, dbusPrivate=False, profiles=PROFILES, **options):
+        self.profiles = profiles
+        self.options = options
+        self.scheduler = TickScheduler(options.get('resolution', 60))
         if 'DBUS_SESSION_BUS_ADDRESS' in os.environ:
             self.bus = dbus.SessionBus(private=dbusPrivate)
         else:
@@ -151,10 +172,10 @@ class TeaLoggerService:
         self.imported = {}
         self.bus.add_signal_receiver(self.dbus_name_owner_changed, signal_name='NameOwnerChanged')
 
-        logging.info('Searching dbus for vebus devices...')
+        logging.info('Searching dbus for %s devices...' % ', '.join(p.name for p in profiles))
         for serviceName in self.bus.list_names():
             self.check_dbus_service(serviceName)
-        logging.info('Finished search for vebus devices')
+        logging.info('Finished search for devices')
 
     def dbus_name_owner_changed(self, name, oldOwner, newOwner):
         # decouple, and process in main loop
@@ -165,27 +186,51 @@ class TeaLoggerService:
 
         if newOwner != '':
             self.check_dbus_service(name)
-        else:
-            pass # Would remove imported service/path
-
-    def is_service_pzem016(self, serviceName):
-        return serviceName.split('.')[0:4] == ['fr', 'mildred', 'pzemvictron2020', 'pzem016']
-
-    def is_service_battery(self, serviceName):
-        return serviceName.split('.')[0:3] == ['com', 'victronenergy', 'battery']
+        elif name in self.imported:
+            logging.info("%s left the bus, closing its log" % name)
+            self.imported.pop(name).close()
+            VeDbusImportManager.get(self.bus).remove_service(name)
 
     def check_dbus_service(self, serviceName):
         if serviceName in self.imported:
             #logging.debug("%s already imported" % serviceName)
             return
-        if self.is_service_battery(serviceName):
-            self.imported[serviceName] = TeaBatteryBusLogger(self.fpath % serviceName, self.bus, serviceName)
+        profile = find_profile(serviceName, self.profiles)
+        if profile is None:
+            return
+        logging.info("Logging %s with the %s profile" % (serviceName, profile.name))
+        self.imported[serviceName] = TeaBusLogger(self.fpath % serviceName, self.bus, serviceName, profile.metrics,
+            scheduler=self.scheduler, **self.options)
+
+    def close(self):
+        for logger in self.imported.values():
+            logger.close()
 
 def main():
     from optparse import OptionParser
     parser = OptionParser()
     parser.add_option("-d", "--datadir", dest="datadir", default="/data/tealog",
                       help="data directory", metavar="DIR")
+    parser.add_option("--sparse", dest="sparse", action="store_true",
+                      help="record the minutes missed while not running in a gap index instead of writing empty records")
+    parser.add_option("--partition", dest="partition", choices=PARTITIONS, default="none",
+                      help="split the logs in one file per day or month (none, day or month)")
+    parser.add_option("--retention", dest="retention", type="int", metavar="DAYS",
+                      help="delete the partitions older than DAYS days")
+    parser.add_option("--no-rollup", dest="rollup", action="store_false", default=True,
+                      help="do not maintain the hourly and daily rollups")
+    parser.add_option("--sync-interval", dest="syncinterval", type="int", default=15, metavar="MINUTES",
+                      help="write the logs to the storage device every MINUTES minutes (default 15, 0 to leave it to the system)")
+    parser.add_option("--buffer", dest="buffered", type="int", default=15, metavar="MINUTES",
+                      help="keep MINUTES minutes in memory and write them at once (default 15, 1 to write every minute)")
+    parser.add_option("--capture", dest="capture", choices=CAPTURES, default="sample",
+                      help="sample the metrics at each slot, or aggregate every change received during the slot (sample or events)")
+    parser.add_option("--resolution", dest="resolution", type="choice", choices=["1", "10", "60"], default="60", metavar="SECONDS",
+                      help="duration of a slot: 1, 10 or 60 seconds (default 60)")
+    parser.add_option("--max-backfill", dest="maxbackfill", type="int", default=7 * 24, metavar="HOURS",
+                      help="interpolate the counters missed during an outage of up to HOURS hours (default %default, 0 to disable)")
+    parser.add_option("--profiles", dest="profiles", default=','.join(p.name for p in PROFILES), metavar="NAMES",
+                      help="comma separated profiles of the services to log (default %default)")
     parser.add_option("--debug", dest="debug", action="store_true", help="set logging level to debug")
     (opts, args) = parser.parse_args()
 
@@ -196,10 +241,25 @@ def main():
     # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
     DBusGMainLoop(set_as_default=True)
 
-    TeaLoggerService(opts.datadir)
+    try:
+        profiles = select_profiles(opts.profiles)
+    except ValueError as e:
+        parser.error(str(e))
+
+    service = TeaLoggerService(opts.datadir, profiles=profiles, sparse=opts.sparse,
+        partition=opts.partition, retention=opts.retention, rollup=opts.rollup,
+        syncinterval=(opts.syncinterval or None), buffered=max(opts.buffered, 1),
+        capture=opts.capture, resolution=int(opts.resolution), maxbackfill=opts.maxbackfill * 3600)
 
     logging.info("Starting mainloop, responding only on events")
     mainloop = gobject.MainLoop()
+
+    def terminate(signum, frame):
+        logging.info("Terminating, writing the buffered records")
+        service.close()
+        mainloop.quit()
+    signal.signal(signal.SIGTERM, terminate)
+
     mainloop.run()
 
 if __name__ == "__main__":
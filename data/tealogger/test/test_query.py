@@ -0,0 +1,114 @@
+''' pytest tests of the aggregated reads of the series '''
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import StringIO
+import subprocess
+import pytest
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'ext', 'TeaFiles.Py'))
+
+import query
+from storage import PartitionedSeries, open_series
+
+def setup_module(m):
+    global datadir, series, start
+    datadir = tempfile.mkdtemp()
+    fpath = os.path.join(datadir, 'log-test.tea')
+    start = datetime.datetime(2024, 3, 2)
+    nan = float('nan')
+    s = PartitionedSeries(fpath, ['Energy', 'Power'], 'dd', 'test', partition='day', rollup=True)
+    s.write_many([(start + datetime.timedelta(minutes=i), [i * 0.5, float(i % 7) if not 100 <= i < 300 else nan])
+                  for i in range(3 * 24 * 60)])
+    s.close()
+    series = open_series(fpath)
+
+def teardown_module(m):
+    shutil.rmtree(datadir)
+
+def raw(width, monkeypatch):
+    ''' the query of series at width seconds, from the minutes only '''
+    monkeypatch.setattr(series, 'rollups', [])
+    rows = list(query.query(series, ['Energy', 'Power'], start, start + datetime.timedelta(days=3), width))
+    monkeypatch.undo()
+    return rows
+
+@pytest.mark.parametrize('width', [3600, 2 * 3600, 86400])
+def test_rollups_match_minutes(width, monkeypatch):
+    assert query.tier(series, width, start) == (86400 if width == 86400 else 3600, None)
+    rows = list(query.query(series, ['Energy', 'Power'], start, start + datetime.timedelta(days=3), width))
+    expected = raw(width, monkeypatch)
+    assert len(rows) == 3 * 86400 // width
+    gap = (start + datetime.timedelta(minutes=100), start + datetime.timedelta(minutes=300))
+    for (when, values), (expectedwhen, expectedvalues) in zip(rows, expected):
+        assert when == expectedwhen
+        for v, e in zip(values, expectedvalues):
+            assert [x == x for x in v] == [x == x for x in e]
+            if when < gap[1] and when + datetime.timedelta(seconds=width) > gap[0]:
+                # the mean of the rollups is the mean of their rows, whatever their number of minutes
+                v, e = v[:1] + v[2:], e[:1] + e[2:]
+            assert [x for x in v if x == x] == pytest.approx([x for x in e if x == x])
+
+def test_chunks(monkeypatch):
+    expected = list(query.query(series, ['Energy'], start, start + datetime.timedelta(days=1), 900))
+    monkeypatch.setattr(query, 'CHUNK', 100)
+    rows = list(query.query(series, ['Energy'], start, start + datetime.timedelta(days=1), 900))
+    assert rows == expected
+    assert len(rows) == 96
+    assert rows[0][1][0] == (7.0, 3.5, 7.0)
+    assert rows[1][1][0] == (7.5, 11.0, 14.5)
+
+def test_aligned_start():
+    rows = list(query.query(series, ['Energy'], start + datetime.timedelta(minutes=20), start + datetime.timedelta(hours=2), 3600))
+    assert [when for when, values in rows] == [start, start + datetime.timedelta(hours=1)]
+
+def test_formats():
+    rows = list(query.query(series, ['Power'], start + datetime.timedelta(hours=2), start + datetime.timedelta(hours=4), 3600))
+    out = StringIO.StringIO()
+    query.write_csv(out, ['Power'], rows)
+    lines = out.getvalue().splitlines()
+    assert lines[0] == 'time,Power_delta,Power_mean,Power_max'
+    assert lines[1] == '2024-03-02T02:00:00Z,,,'
+    assert lines[2].startswith('2024-03-02T03:00:00Z,')
+    out = StringIO.StringIO()
+    query.write_json(out, ['Power'], rows)
+    lines = out.getvalue().splitlines()
+    assert lines[0] == '{"Power": {"delta": null, "max": null, "mean": null}, "time": "2024-03-02T02:00:00Z"}'
+    assert len(lines) == 2
+
+def test_parse():
+    assert query.parse_duration('15m') == 900
+    assert query.parse_duration('1d') == 86400
+    assert query.parse_time('2024-03-02T01:30') == datetime.datetime(2024, 3, 2, 1, 30)
+    with pytest.raises(ValueError):
+        query.parse_duration('1w')
+
+def test_rollups_enabled_later():
+    datadir = tempfile.mkdtemp()
+    try:
+        fpath = os.path.join(datadir, 'log-test.tea')
+        start = datetime.datetime(2024, 3, 2)
+        rows = [(start + datetime.timedelta(minutes=i), [i * 0.5]) for i in range(3 * 24 * 60)]
+        s = PartitionedSeries(fpath, ['Energy'], 'd', 'test', partition='day')
+        s.write_many(rows[:2 * 24 * 60 + 600])
+        s.close()
+        s = PartitionedSeries(fpath, ['Energy'], 'd', 'test', partition='day', rollup=True)
+        s.write_many(rows[2 * 24 * 60 + 600:])
+        s.close()
+        output = subprocess.check_output([sys.executable, os.path.join(os.path.dirname(__file__), '..', 'tealogger-query.py'),
+            '-d', datadir, '-s', 'test', '-r', '1d', '--from', '2024-03-02', '--to', '2024-03-05'])
+        assert output.splitlines() == [
+            'time,Energy_delta,Energy_mean,Energy_max',
+            '2024-03-02T00:00:00Z,719.5,359.75,719.5',
+            '2024-03-03T00:00:00Z,720.0,1079.75,1439.5',
+            '2024-03-04T00:00:00Z,720.0,1799.75,2159.5']
+        # the hours before the first bucket of the hourly rollup are read from the minutes
+        series = open_series(fpath)
+        assert query.tier(series, 3600, start) == (60, datetime.datetime(2024, 3, 4, 10))
+        hours = list(query.query(series, ['Energy'], start, start + datetime.timedelta(days=3), 3600))
+        assert [values[0][0] for when, values in hours] == [29.5] + [30.0] * (3 * 24 - 1)
+    finally:
+        shutil.rmtree(datadir)
@@ -0,0 +1,178 @@
+''' pytest tests of the storage of the series '''
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import pytest
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'ext', 'TeaFiles.Py'))
+
+from storage import PartitionedSeries, open_series
+
+def setup_function(f):
+    global datadir
+    datadir = tempfile.mkdtemp()
+
+def teardown_function(f):
+    shutil.rmtree(datadir)
+
+def minutes(start, rows):
+    ''' the rows of consecutive minutes from start, with the values of rows '''
+    return [(start + datetime.timedelta(minutes=i), values) for i, values in enumerate(rows)]
+
+def test_write_before_origin():
+    fpath = os.path.join(datadir, 'log-test.tea')
+    series = PartitionedSeries(fpath, ['A'], 'd', 'test', rollup=True)
+    day = datetime.datetime(2024, 3, 2)
+    series.write_many(minutes(day, [[1.0], [2.0]]))
+    # the clock went back to the day before
+    assert series.write(day - datetime.timedelta(minutes=1), [0.0]) is None
+    series.write_many(minutes(day + datetime.timedelta(minutes=2), [[3.0]]))
+    series.close()
+    series = open_series(fpath)
+    assert list(series.columns(day, day + datetime.timedelta(minutes=3)).A) == [1.0, 2.0, 3.0]
+    first, c = series.rollups[0].columns(day, day + datetime.timedelta(hours=1))
+    assert first == day
+    assert list(c.A_max) == [3.0] and list(c.A_delta) == [2.0]
+
+def backfill(sparse):
+    ''' a series whose counters were missed for 10 minutes, interpolated '''
+    fpath = os.path.join(datadir, 'log-test.tea')
+    series = PartitionedSeries(fpath, ['Energy', 'Power', 'Total'], 'ddd', 'test', sparse=sparse, rollup=True)
+    start = datetime.datetime(2024, 3, 2)
+    nan = float('nan')
+    # Total, imported first, is measured 2 minutes longer than Energy
+    series.write_many(minutes(start, [[10.0, 1.0, 100.0], [11.0, 2.0, 101.0]]))
+    series.write_many(minutes(start + datetime.timedelta(minutes=2), [[nan, 3.0, 102.0], [nan, 4.0, 103.0]]))
+    # tealogger was not running, then buffered rows until Energy was imported
+    series.write_many(minutes(start + datetime.timedelta(minutes=10), [[nan, 5.0, nan]]))
+    when = start + datetime.timedelta(minutes=11)
+    assert series.backfill(when, [21.0, 6.0, 111.0], ['Energy', 'Total'], 3600) == 9
+    series.write(when, [21.0, 6.0, 111.0])
+    series.close()
+    return open_series(fpath), start
+
+@pytest.mark.parametrize('sparse', [False, True])
+@pytest.mark.parametrize('chunk', [10000, 4])
+def test_backfill(sparse, chunk, monkeypatch):
+    # with chunks of 4 slots, the last records and the missed slots span several chunks
+    monkeypatch.setattr('storage.BACKFILL_CHUNK', chunk)
+    series, start = backfill(sparse)
+    c = series.columns(start, start + datetime.timedelta(minutes=12))
+    assert list(c.Energy) == [10.0 + i for i in range(12)]
+    assert list(c.Total) == [100.0 + i for i in range(12)]
+    # the other metrics are not interpolated
+    assert [p for p in c.Power if p == p] == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+    assert [p == p for p in c.Power] == [True] * 4 + [False] * 6 + [True] * 2
+    assert series.estimated(start, start + datetime.timedelta(days=1)) == [
+        ('Energy', start + datetime.timedelta(minutes=2), start + datetime.timedelta(minutes=11)),
+        ('Total', start + datetime.timedelta(minutes=4), start + datetime.timedelta(minutes=11))]
+    first, rollup = series.rollups[0].columns(start, start + datetime.timedelta(hours=1))
+    assert list(rollup.Energy_delta) == [11.0] and list(rollup.Total_delta) == [11.0]
+
+def test_partitions():
+    fpath = os.path.join(datadir, 'log-test.tea')
+    series = PartitionedSeries(fpath, ['A'], 'd', 'test', partition='day', retention=3)
+    start = datetime.datetime(2024, 2, 28, 23, 58)
+    series.write_many(minutes(start, [[1.0], [2.0], [3.0]]))
+    # the rest of 2024-02-29 is missed
+    series.write_many(minutes(datetime.datetime(2024, 3, 1, 0, 1), [[4.0]]))
+    series.close()
+    assert sorted(os.listdir(datadir)) == ['log-test-20240228.tea', 'log-test-20240229.tea',
+                                           'log-test-20240301.tea', 'log-test.manifest']
+    series = open_series(fpath)
+    assert series.partition == 'day'
+    c = series.columns(start, datetime.datetime(2024, 3, 1, 0, 3))
+    values = list(c.A)
+    assert values[:3] == [1.0, 2.0, 3.0]
+    assert values[-2:] == [4.0, values[-1]] and values[-1] != values[-1]
+    assert len(values) == 2 + 24 * 60 + 3
+    assert all(v != v for v in values[3:-2])
+    # the partitions older than 3 days are removed as new ones are created
+    series = PartitionedSeries(fpath, ['A'], 'd', 'test', partition='day', retention=3)
+    series.write(datetime.datetime(2024, 3, 3), [5.0])
+    series.close()
+    assert 'log-test-20240228.tea' not in os.listdir(datadir)
+    assert len(open_series(fpath).columns(start, datetime.datetime(2024, 3, 1)).A) == 2 + 24 * 60
+
+def raw_aggregates(column, size):
+    ''' the (max, mean, delta) of the buckets of size slots of column, computed as the rollups do '''
+    result = []
+    for b in range(0, len(column), size):
+        values = [v for v in column[b:b + size] if v == v]
+        before = column[b - 1] if b > 0 else float('nan')
+        baseline = before if before == before else values[0]
+        result.append((max(values), sum(values) / len(values), values[-1] - baseline))
+    return result
+
+def test_rollups():
+    fpath = os.path.join(datadir, 'log-test.tea')
+    start = datetime.datetime(2024, 3, 2)
+    nan = float('nan')
+    rows = [[i * 0.5 if not 100 <= i < 130 else nan, float(i % 7)] for i in range(2 * 24 * 60)]
+    series = PartitionedSeries(fpath, ['Energy', 'Power'], 'dd', 'test', partition='day', rollup=True)
+    series.write_many(minutes(start, rows[:1000]))
+    series.close()
+    # restarting in the middle of a bucket, the rollups replay the minutes on disk
+    series = PartitionedSeries(fpath, ['Energy', 'Power'], 'dd', 'test', partition='day', rollup=True)
+    for k in range(1000, len(rows), 15):
+        series.write_many(minutes(start + datetime.timedelta(minutes=k), rows[k:k + 15]))
+    series.close()
+    series = open_series(fpath)
+    end = start + datetime.timedelta(days=2)
+    raw = series.columns(start, end)
+    for r, size in zip(series.rollups, (60, 24 * 60)):
+        step, first, c = series.query(start, end, datetime.timedelta(minutes=size))
+        assert step == datetime.timedelta(minutes=size) and first == start
+        for field in ('Energy', 'Power'):
+            expected = raw_aggregates(list(getattr(raw, field)), size)
+            rollup = zip(getattr(c, field + '_max'), getattr(c, field + '_mean'), getattr(c, field + '_delta'))
+            assert len(rollup) == len(expected)
+            for a, b in zip(rollup, expected):
+                assert a == pytest.approx(b)
+
+def test_rollups_enabled_later():
+    fpath = os.path.join(datadir, 'log-test.tea')
+    start = datetime.datetime(2024, 3, 2)
+    rows = [[i * 0.5] for i in range(3 * 24 * 60)]
+    series = PartitionedSeries(fpath, ['Energy'], 'd', 'test', partition='day')
+    series.write_many(minutes(start, rows[:2 * 24 * 60 + 600]))
+    series.close()
+    # the rollups start at 10:00 on the third day
+    series = PartitionedSeries(fpath, ['Energy'], 'd', 'test', partition='day', rollup=True)
+    series.write_many(minutes(start + datetime.timedelta(minutes=2 * 24 * 60 + 600), rows[2 * 24 * 60 + 600:]))
+    series.close()
+    series = open_series(fpath)
+    hour, day = series.rollups
+    third = start + datetime.timedelta(days=2)
+    assert day.covers(third) and not day.covers(third - datetime.timedelta(minutes=1))
+    assert hour.covers(third + datetime.timedelta(hours=10)) and not hour.covers(third + datetime.timedelta(hours=9))
+    # ranges starting before the rollups are read from the minutes
+    step, first, c = series.query(start, start + datetime.timedelta(days=3), datetime.timedelta(days=1))
+    assert step == datetime.timedelta(minutes=1) and list(c.Energy) == [r[0] for r in rows]
+    step, first, c = series.query(third, third + datetime.timedelta(days=1), datetime.timedelta(days=1))
+    assert step == datetime.timedelta(days=1)
+    assert list(c.Energy_delta) == [24 * 60 * 0.5] and list(c.Energy_max) == [rows[-1][0]]
+
+@pytest.mark.parametrize('partition', ['day', 'month'])
+def test_corrupt_manifest(partition):
+    fpath = os.path.join(datadir, 'log-test.tea')
+    series = PartitionedSeries(fpath, ['A'], 'd', 'test', partition=partition)
+    start = datetime.datetime(2024, 1, 31, 23, 59)
+    series.write_many(minutes(start, [[1.0], [2.0]]))
+    series.close()
+    # other series of the same directory are not partitions of this one
+    PartitionedSeries(os.path.join(datadir, 'log-test-events-10s.tea'), ['A'], 'd', 'test', partition='day').write(start, [0.0])
+    expected = open_series(fpath).partitions
+    for content in ('', '{"partition": "day", "partitions": [{'):
+        with open(os.path.join(datadir, 'log-test.manifest'), 'w') as f:
+            f.write(content)
+        series = open_series(fpath)
+        assert series.partition == partition and series.partitions == expected
+        assert list(series.columns(start, start + datetime.timedelta(minutes=2)).A) == [1.0, 2.0]
+    series = PartitionedSeries(fpath, ['A'], 'd', 'test', partition=partition)
+    series.write(datetime.datetime(2024, 3, 1), [3.0])
+    series.close()
+    assert len(open_series(fpath).partitions) == 3
@@ -0,0 +1,80 @@
+''' pytest tests of the tick scheduler '''
+
+import os
+import sys
+import time
+import types
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'ext', 'TeaFiles.Py'))
+try:
+    import gobject
+except ImportError:
+    # the scheduler only uses the timers of gobject, replaced by Clock below
+    sys.modules['gobject'] = types.ModuleType('gobject')
+
+import ticks
+
+class Clock:
+    ''' the wall clock and the timers of gobject, run by hand '''
+    def __init__(self, now):
+        self.now = now
+        self.timers = []
+
+    def time(self):
+        return self.now
+
+    def strftime(self, format, t):
+        return time.strftime(format, t)
+
+    def gmtime(self, seconds):
+        return time.gmtime(seconds)
+
+    def timeout_add(self, ms, callback):
+        self.timers.append(callback)
+
+    def fire(self, now):
+        ''' sets the clock to now and runs the timer '''
+        self.now = now
+        callback, = self.timers
+        self.timers = []
+        callback()
+
+class Logger:
+    serviceName = 'test'
+
+    def __init__(self):
+        self.slots = []
+
+    def update(self, boundary):
+        self.slots.append(boundary)
+
+def scheduler(monkeypatch, now):
+    clock = Clock(now)
+    monkeypatch.setattr(ticks, 'time', clock)
+    monkeypatch.setattr(ticks, 'gobject', clock)
+    s = ticks.TickScheduler(60)
+    logger = Logger()
+    s.add(logger)
+    return clock, s, logger
+
+def test_ticks(monkeypatch):
+    clock, s, logger = scheduler(monkeypatch, 6000.5)
+    clock.fire(6060.01)
+    clock.fire(6119.9)      # early
+    clock.fire(6120.02)
+    clock.fire(6300.0)      # suspended
+    assert logger.slots == [6060, 6120, 6300]
+    assert s.missed == 2
+
+def test_clock_back(monkeypatch):
+    clock, s, logger = scheduler(monkeypatch, 6000.5)
+    clock.fire(6060.0)
+    clock.fire(6120.0)
+    # back by less than a slot, the slot 6060 is not written again
+    clock.fire(6100.0)
+    clock.fire(6180.0)
+    assert logger.slots == [6060, 6120, 6180]
+    # back by 2 hours, ticking goes on from the current slot
+    clock.fire(6180.0 - 7200 + 60)
+    clock.fire(6180.0 - 7200 + 120)
+    assert logger.slots == [6060, 6120, 6180, 6180 - 7200 + 60, 6180 - 7200 + 120]
@@ -0,0 +1,76 @@
+import gobject
+import logging
+import math
+import time
+
+from storage import Aggregate
+
+## Calls the update method of the loggers registered with add at the start of
+# each slot, from a single timer.
+#
+# Each tick schedules the next one at the following slot boundary of the wall
+# clock, so ticks do not drift. Ticks firing early are postponed, and clock
+# jumps are logged and counted rather than replayed: the series fill the slots
+# skipped forward. After the clock went back by a slot, the slot is not ticked
+# again. After a larger jump back, like a correction of the clock of a GX
+# without RTC, ticking goes on from the current slot rather than waiting for
+# the clock to catch up. The lateness of the ticks is reported every hour.
+class TickScheduler:
+    def __init__(self, resolution=60):
+        self.resolution = resolution
+        self.loggers = []
+        self.last = None            # the last slot boundary ticked, in seconds since the epoch
+        self.lateness = Aggregate()
+        self.missed = 0
+        self.schedule()
+
+    def add(self, logger):
+        self.loggers.append(logger)
+
+    def remove(self, logger):
+        if logger in self.loggers:
+            self.loggers.remove(logger)
+
+    def schedule(self):
+        now = time.time()
+        boundary = (int(now) // self.resolution + 1) * self.resolution
+        gobject.timeout_add(int(math.ceil(1e3 * (boundary - now))), self.tick)
+
+    def tick(self):
+        now = time.time()
+        boundary = int(now) // self.resolution * self.resolution
+        if boundary == self.last:
+            # fired before the boundary
+            self.schedule()
+            return False
+        if self.last is not None and boundary < self.last:
+            if boundary >= self.last - self.resolution:
+                # the slot is already written, wait for the clock to catch up
+                logging.warning("Clock went back by %ds, skipping the tick" % (self.last - boundary))
+                self.schedule()
+                return False
+            logging.warning("Clock went back by %ds, ticking from %s" % (self.last - boundary,
+                time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(boundary))))
+        elif self.last is not None and boundary > self.last + self.resolution:
+            missed = (boundary - self.last) // self.resolution - 1
+            logging.warning("Missed %d ticks, the clock jumped or the system was suspended" % missed)
+            self.missed += missed
+        self.last = boundary
+        self.lateness.add(now - boundary)
+        for logger in list(self.loggers):
+            try:
+                logger.update(boundary)
+            except Exception:
+                logging.exception("Failed to update %s" % logger.serviceName)
+        if boundary % 3600 == 0:
+            self.report()
+        self.schedule()
+        return False
+
+    def report(self):
+        l = self.lateness
+        if l.count:
+            logging.info("%d ticks, late by %.0fms on average and %.0fms at most, %d missed" % (
+                l.count, 1e3 * l.sum / l.count, 1e3 * l.max, self.missed))
+        self.lateness = Aggregate()
+        self.missed = 0